@@ -1,16 +1,21 @@
 #!/usr/bin/env python3
 """
-BGTANK.py - A simplified launcher that runs launcher.py from the same directory
+BGTANK.py - A simplified launcher that starts BGTANK from the same directory
+
+When the venv is already set up the app is started directly with the venv's
+interpreter, otherwise launcher.py runs first to install the requirements.
 """
 
 import os
 import sys
 import subprocess
 import platform
-import time
+import tempfile
 import logging
 import traceback
 
+import environment
+
 # Configure logging
 log_dir = os.path.join(os.path.expanduser("~"), ".bgtank")
 os.makedirs(log_dir, exist_ok=True)
@@ -62,45 +67,52 @@ def list_files(directory):
         log_message(f"Error listing directory contents: {e}", error=True)
 
 
-def launch_script_with_python(script_path):
-    """Launch a Python script using the correct Python interpreter with visible terminal"""
-    try:
-        # When frozen as exe, we need to use the actual Python interpreter
-        if getattr(sys, 'frozen', False):
-            # For PyInstaller, we should use the system's Python
-            # Try to find Python in the PATH
-            if platform.system().lower() == "windows":
-                python_exec = "python"  # Windows usually has 'python' in PATH
-            else:
-                python_exec = "python3"  # Unix-like systems usually use python3
-        else:
-            # When running as script, use the current interpreter
-            python_exec = sys.executable
+READY_TIMEOUT = 120  # Seconds to wait for the app window before assuming a long first-time setup
+
+
+def get_system_python():
+    """Get the Python interpreter that runs launcher.py"""
+    # When frozen as exe, we need to use the actual Python interpreter
+    if getattr(sys, 'frozen', False):
+        # For PyInstaller, we should use the system's Python
+        # Try to find Python in the PATH
+        if platform.system().lower() == "windows":
+            return "python"  # Windows usually has 'python' in PATH
+        return "python3"  # Unix-like systems usually use python3
+    # When running as script, use the current interpreter
+    return sys.executable
 
+
+def launch_script_with_python(python_exec, script_path, env=None):
+    """Hand over to a Python script, waiting for the app window instead of a fixed delay"""
+    try:
         cmd = [python_exec, script_path]
+        env = dict(env or os.environ)
         log_message(f"Attempting to run: {' '.join(cmd)}")
 
-        if platform.system().lower() == "windows":
-            # Windows: show console window
-            process = subprocess.Popen(
-                cmd
-                # Removed creationflags=subprocess.CREATE_NO_WINDOW to show the terminal
-            )
-            log_message(f"Started process with PID: {process.pid}")
-        else:
-            # Unix: show terminal
-            process = subprocess.Popen(
-                cmd,
-                start_new_session=True
-                # Removed stdout/stderr redirection to show output
-            )
-            log_message(f"Started process with PID: {process.pid}")
-
-        # Give it a moment to start
-        time.sleep(0.5)
-
-        # Check if process is still running (simple check)
-        if process.poll() is None:
+        if platform.system().lower() != "windows":
+            # Unix: replace this process, nothing is left idle behind the app
+            for handler in logging.getLogger().handlers:
+                handler.flush()
+            sys.stdout.flush()
+            os.execvpe(python_exec, cmd, env)
+
+        # Windows: show console window, the app creates the ready file once its window is up
+        ready_path = os.path.join(tempfile.gettempdir(), f"bgtank_ready_{os.getpid()}")
+        if os.path.exists(ready_path):
+            os.remove(ready_path)
+        env[environment.READY_FILE_ENV_VAR] = ready_path
+
+        process = subprocess.Popen(cmd, env=env)
+        log_message(f"Started process with PID: {process.pid}")
+
+        ready = environment.wait_until_ready(process, ready_path, READY_TIMEOUT)
+        try:
+            os.remove(ready_path)
+        except OSError:
+            pass
+
+        if ready:
             log_message("Process started successfully")
             return True
         else:
@@ -130,6 +142,17 @@ def main():
         os.chdir(exe_dir)
         log_message(f"Changed working directory to: {os.getcwd()}")
 
+        # A venv stamped for the current requirements can run main.py directly
+        venv_python = environment.get_venv_python(exe_dir)
+        main_path = os.path.join(exe_dir, "main.py")
+        if environment.stamp_matches(exe_dir) and os.path.isfile(venv_python) and os.path.isfile(main_path):
+            log_message("Environment is ready, starting main.py directly")
+            env = dict(os.environ)
+            env[environment.READY_ENV_VAR] = environment.read_stamp(exe_dir)
+            if launch_script_with_python(venv_python, main_path, env):
+                return 0
+            log_message("Direct start failed, falling back to launcher.py", error=True)
+
         # Path to launcher.py (should be in the same directory)
         launcher_path = os.path.join(exe_dir, "launcher.py")
 
@@ -146,7 +169,7 @@ def main():
         log_message(f"Found launcher.py: {launcher_path} ({os.path.getsize(launcher_path)} bytes)")
 
         # Launch launcher.py
-        if launch_script_with_python(launcher_path):
+        if launch_script_with_python(get_system_python(), launcher_path):
             log_message("Successfully launched launcher.py")
             return 0
         else:
@@ -0,0 +1,179 @@
+"""
+archives.py - ZIP and TAR input and ZIP output for BGTANK
+
+Images inside an archive are addressed as "archive.zip::folder/image.jpg" and
+read straight from the archive, so a delivery never has to be extracted to
+disk first. ZIP members are streamed, TAR members are read into memory one at
+a time. Outputs can be written straight into a ZIP archive instead of
+separate files. Each result is encoded in memory and appended as one member.
+"""
+
+import io
+import os
+import tarfile
+import threading
+import zipfile
+from contextlib import contextmanager
+
+MEMBER_SEP = "::"
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".webp")
+DEFAULT_OUTPUT_ARCHIVE = "bgtank_output.zip"  # Used by the app, the command line takes any name
+
+_readers = {}
+_readers_lock = threading.Lock()
+
+
+def is_archive(path):
+    return path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def is_member(path):
+    """Check whether a path points into an archive"""
+    return MEMBER_SEP in path
+
+
+def member_path(archive_path, member):
+    return f"{archive_path}{MEMBER_SEP}{member}"
+
+
+def split_member(path):
+    """Split an archive member path into (archive path, member name)"""
+    archive_path, _, member = path.partition(MEMBER_SEP)
+    return archive_path, member
+
+
+class ArchiveReader:
+    """Input archive opened once and shared by every thread"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        if zipfile.is_zipfile(path):
+            # ZipFile serializes reads of the shared file itself, so members stream in parallel
+            self.zip = zipfile.ZipFile(path)
+            self.tar = None
+            self.members = {info.filename: info for info in self.zip.infolist() if not info.is_dir()}
+        else:
+            self.zip = None
+            self.tar = tarfile.open(path, "r:*")
+            # Indexed once, tarfile looks names up with a linear scan
+            self.members = {info.name: info for info in self.tar.getmembers() if info.isfile()}
+
+    def images(self):
+        """Member names of the images in the archive, sorted"""
+        return sorted(name for name in self.members if name.lower().endswith(IMAGE_EXTENSIONS))
+
+    def size(self, member):
+        info = self.members.get(member)
+        if info is None:
+            raise FileNotFoundError(f"{member} not found in {self.path}")
+        return info.file_size if self.zip else info.size
+
+    def open(self, member):
+        """Binary file object of a member"""
+        info = self.members.get(member)
+        if info is None:
+            raise FileNotFoundError(f"{member} not found in {self.path}")
+        if self.zip:
+            return self.zip.open(info)
+        # TAR members share the archive's read position, so they are read whole under the lock
+        with self.lock:
+            return io.BytesIO(self.tar.extractfile(info).read())
+
+    def close(self):
+        (self.zip or self.tar).close()
+
+
+def get_reader(archive_path):
+    """Shared reader of an input archive, opened on first use"""
+    key = os.path.abspath(archive_path)
+    with _readers_lock:
+        reader = _readers.get(key)
+        if reader is None:
+            reader = _readers[key] = ArchiveReader(archive_path)
+        return reader
+
+
+def close_readers():
+    """Close every open input archive, they are opened again when needed"""
+    with _readers_lock:
+        readers = list(_readers.values())
+        _readers.clear()
+    for reader in readers:
+        reader.close()
+
+
+def archive_images(archive_path):
+    """Member paths of the images in an archive"""
+    return [member_path(archive_path, name) for name in get_reader(archive_path).images()]
+
+
+def input_size(path):
+    """Size in bytes of an input file or archive member"""
+    if is_member(path):
+        archive_path, member = split_member(path)
+        return get_reader(archive_path).size(member)
+    return os.path.getsize(path)
+
+
+@contextmanager
+def open_input(path):
+    """Open an input file or archive member for binary reading"""
+    if is_member(path):
+        archive_path, member = split_member(path)
+        f = get_reader(archive_path).open(member)
+    else:
+        f = open(path, "rb")
+    with f:
+        yield f
+
+
+def output_archive_names(path):
+    """Members of an output archive
+
+    An archive left incomplete by an interrupted run can't be read, it is
+    moved aside to <name>.incomplete (tools like zip -FF can still recover
+    it) so the next run starts a new one.
+    """
+    if not os.path.exists(path):
+        return set()
+    if not zipfile.is_zipfile(path):
+        os.replace(path, f"{path}.incomplete")
+        return set()
+    with zipfile.ZipFile(path) as archive:
+        return set(archive.namelist())
+
+
+class ZipOutput:
+    """Output archive the worker threads add their results to"""
+
+    def __init__(self, path):
+        # A run that was interrupted leaves the archive without its central directory
+        if os.path.exists(path) and not zipfile.is_zipfile(path):
+            raise ValueError(f"{os.path.basename(path)} is not a complete ZIP archive, "
+                             f"remove it or choose another output")
+        self.path = path
+        self.lock = threading.Lock()
+        # PNGs are compressed already, storing them keeps the writer from using the CPU twice
+        self.zip = zipfile.ZipFile(path, "a", compression=zipfile.ZIP_STORED, allowZip64=True)
+
+    def write(self, member, image, **params):
+        """Encode an image as PNG and add it, the encode runs outside the lock"""
+        buffer = io.BytesIO()
+        image.save(buffer, "PNG", **params)
+        self.write_bytes(member, buffer.getbuffer())
+
+    def write_bytes(self, member, data):
+        with self.lock:
+            self.zip.writestr(member, data)
+
+    def copy(self, source_member, member):
+        """Add an already written member again under another name"""
+        with self.lock:
+            self.zip.writestr(member, self.zip.read(source_member))
+
+    def close(self):
+        """Write the central directory, the archive is only readable after this"""
+        with self.lock:
+            self.zip.close()
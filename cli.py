@@ -0,0 +1,393 @@
+"""
+cli.py - Headless command line interface for BGTANK
+
+Runs the batch engine without the GUI, either on a single machine or as one of
+many render nodes working through a sharded job on a shared filesystem:
+
+    python cli.py run -o out/ photos/
+    python cli.py run -o out/ delivery.zip --archive results.zip
+    python cli.py status out/ --failed
+    python cli.py requeue out/              (then run again to retry the failures)
+    python cli.py shard create /mnt/jobs/q3 -o /mnt/out /mnt/photos
+    python cli.py shard work /mnt/jobs/q3        (on every render node)
+    python cli.py shard status /mnt/jobs/q3
+    python cli.py shard requeue /mnt/jobs/q3     (then shard work again)
+"""
+
+import argparse
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+
+from archives import IMAGE_EXTENSIONS, archive_images, is_archive
+from dedup import FANOUT_COPY, FANOUT_LINK
+from engine import DEFAULT_RETRIES, BatchEngine, requeue_missing_outputs
+from jobstore import DONE, FAILED, PENDING, RUNNING, JobStore, job_store_path
+from models import AUTO_MODEL, DEFAULT_MODEL, MODEL_PROFILES, default_batch_size, default_workers
+from profiling import DEFAULT_PROFILE_EVERY, RunProfiler
+from report import RunReport, report_path_for
+from scheduler import JOB_ORDERS, ORDER_LARGEST_FIRST
+from sessionpool import SessionPool
+from sharding import (DEFAULT_CHUNK_SIZE, DEFAULT_LEASE_TTL, chunk_name, claim_next, create_job,
+                      default_node_id, job_status, load_manifest, read_chunk, requeue_failures, write_failures)
+
+SHARD_POLL_INTERVAL = 30  # Seconds between looks for expired leases once no chunk is free
+
+
+def log(message):
+    """Print a timestamped line"""
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] {message}", flush=True)
+
+
+def collect_images(paths):
+    """Expand directories and archives into the images they contain, files are kept as given"""
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                images.extend(os.path.join(root, name) for name in sorted(files)
+                              if name.lower().endswith(IMAGE_EXTENSIONS))
+        elif is_archive(path):
+            images.extend(archive_images(path))
+        else:
+            images.append(path)
+    return images
+
+
+def input_roots(paths):
+    """Input directories, absolute, so outputs can keep the subdirectories below them"""
+    return [os.path.abspath(path) for path in paths if os.path.isdir(path)]
+
+
+def print_download(model_name, done_bytes, total_bytes, seconds_left):
+    """Download progress of a missing model, printed on one line"""
+    if total_bytes:
+        line = f"Downloading {model_name}: {done_bytes * 100 // total_bytes}%"
+    else:
+        line = f"Downloading {model_name}: {done_bytes // (1024 * 1024)} MB"
+    if seconds_left is not None:
+        line += f", {int(seconds_left)}s left"
+    end = "\n" if total_bytes and done_bytes >= total_bytes else ""
+    print(f"\r{line:<60}", end=end, file=sys.stderr, flush=True)
+
+
+def print_messages(message_queue):
+    """Print the engine's queue messages until the None sentinel arrives"""
+    while True:
+        message_type, message = message_queue.get()
+        if message_type is None:
+            return
+        if message_type in ("status", "success"):
+            log(message)
+        elif message_type in ("error", "fatal_error"):
+            log(f"ERROR: {message}")
+
+
+def run_engine(session_pool, settings, output_dir, paths, report, workers, store=None):
+    """Run one batch, or the pending items of a job store, printing the messages, returns the engine"""
+    model_name = settings["model"]
+    profile_every = settings.get("profile_every", 0)
+    message_queue = queue.Queue()
+    printer = threading.Thread(target=print_messages, args=(message_queue,), daemon=True)
+    printer.start()
+
+    engine = BatchEngine(session_pool, model_name, output_dir, settings["suffix"], message_queue, report,
+                         workers=workers or default_workers(model_name),
+                         batch_size=default_batch_size(model_name),
+                         skip_duplicates=settings["skip_duplicates"],
+                         match_near_duplicates=settings["match_near_duplicates"],
+                         duplicate_mode=settings["duplicate_mode"],
+                         max_output_size=settings["max_output_size"],
+                         job_order=settings["job_order"],
+                         store=store,
+                         retries=settings.get("retries", DEFAULT_RETRIES),
+                         profiler=RunProfiler(report.path, profile_every) if profile_every else None,
+                         crop_to_subject=settings.get("crop", False),
+                         padding=settings.get("padding", 0),
+                         output_archive=os.path.join(output_dir, settings["archive"]) if settings.get("archive")
+                         else None,
+                         passthrough=settings.get("passthrough", True),
+                         input_roots=settings.get("input_roots", ()))
+    try:
+        engine.run(paths)
+    finally:
+        message_queue.put((None, None))
+        printer.join()
+    return engine
+
+
+def settings_from_args(args):
+    """Collect the engine settings given on the command line"""
+    return {
+        "model": args.model,
+        "suffix": args.suffix,
+        "skip_duplicates": not args.keep_duplicates,
+        "match_near_duplicates": args.near_duplicates,
+        "duplicate_mode": args.duplicate_mode,
+        "max_output_size": args.max_size,
+        "crop": args.crop,
+        "padding": args.padding,
+        "archive": args.archive,
+        "passthrough": not args.no_passthrough,
+        "job_order": args.order,
+        "retries": args.retries,
+        "profile_every": args.profile_every if args.profile else 0,
+        "input_roots": input_roots(args.inputs),
+    }
+
+
+def command_run(args):
+    """Process images on this machine, resuming the job already in the output directory"""
+    paths = collect_images(args.inputs)
+    if not paths:
+        log("No images found")
+        return 1
+    os.makedirs(args.output, exist_ok=True)
+
+    # Images finished by an earlier run of the same job are skipped unless --fresh is given
+    store = JobStore(job_store_path(args.output))
+    try:
+        store.recover()
+        if args.fresh:
+            store.reset()
+        store.add(paths)
+        settings = settings_from_args(args)
+        if args.archive:
+            missing = requeue_missing_outputs(store, os.path.join(args.output, args.archive), args.suffix,
+                                              settings["input_roots"])
+            if missing:
+                log(f"{missing} done images are missing from {args.archive} and are queued again")
+        counts = store.counts()
+        if counts[DONE] or counts[FAILED]:
+            log(f"{counts[DONE]} images are already done and {counts[FAILED]} failed in this job, "
+                f"use --fresh to start over")
+        if not counts[PENDING]:
+            log("Nothing left to process")
+            return 0
+
+        log(f"Loading {settings['model']}...")
+        session_pool = SessionPool(settings["model"], progress=print_download)
+
+        report = RunReport(report_path_for(args.output))
+        log(f"Processing {counts[PENDING]} images, report: {report.path}")
+        engine = run_engine(session_pool, settings, args.output, None, report, args.workers, store)
+        return 1 if engine.fatal_error else 0
+    finally:
+        store.close()
+
+
+def open_job_store(job):
+    """Open the job store of an output directory or a store file, None if there is no job"""
+    path = job if os.path.isfile(job) else job_store_path(job)
+    if not os.path.exists(path):
+        log(f"No job found at {path}")
+        return None
+    return JobStore(path)
+
+
+def command_status(args):
+    """Print the progress of the job in an output directory"""
+    store = open_job_store(args.job)
+    if store is None:
+        return 1
+    try:
+        counts = store.counts()
+        failures = store.failures() if args.failed else []
+    finally:
+        store.close()
+
+    total = sum(counts.values())
+    print(f"{counts[DONE]}/{total} done, {counts[FAILED]} failed, {counts[RUNNING]} running, "
+          f"{counts[PENDING]} pending")
+    for path, attempts, error in failures:
+        print(f"{path}\t{attempts} attempts\t{error}")
+    return 0
+
+
+def command_requeue(args):
+    """Move the quarantined items of a job back to pending"""
+    store = open_job_store(args.job)
+    if store is None:
+        return 1
+    try:
+        requeued = store.requeue_failed()
+    finally:
+        store.close()
+    log(f"Requeued {requeued} failed images, run the job again to process them")
+    return 0
+
+
+def command_shard_create(args):
+    """Write the manifest and chunks of a sharded job"""
+    # Nodes may run from another working directory, so every path is stored absolute
+    args.inputs = [os.path.abspath(path) for path in args.inputs]
+    paths = collect_images(args.inputs)
+    if not paths:
+        log("No images found")
+        return 1
+    os.makedirs(args.output, exist_ok=True)
+
+    manifest = create_job(args.job_dir, paths, os.path.abspath(args.output),
+                          settings_from_args(args), args.chunk_size)
+    log(f"Created job with {manifest['inputs']} images in {manifest['chunks']} chunks")
+    return 0
+
+
+def command_shard_work(args):
+    """Claim and process chunks of a sharded job until every chunk is done"""
+    manifest = load_manifest(args.job_dir)
+    settings = manifest["settings"]
+    node_id = args.node or default_node_id()
+
+    log(f"Node {node_id} loading {settings['model']}...")
+    session_pool = SessionPool(settings["model"], progress=print_download)
+
+    while True:
+        # Requeued failures are added as new chunks, so the count is read again each time
+        chunk_count = load_manifest(args.job_dir)["chunks"]
+        # Start the scan at a random chunk so nodes don't all race for the same lease
+        lease = claim_next(args.job_dir, node_id, chunk_count, args.lease_ttl,
+                           start=random.randrange(max(1, chunk_count)))
+        if lease is None:
+            status = job_status(args.job_dir, args.lease_ttl)
+            if status["done"] == chunk_count:
+                log("All chunks are done")
+                return 0
+            # Everything left is leased, wait in case one of those nodes dies
+            time.sleep(SHARD_POLL_INTERVAL)
+            continue
+
+        name = chunk_name(lease.index)
+        log(f"Claimed {name}")
+        try:
+            paths = read_chunk(args.job_dir, lease.index)
+            report = RunReport(os.path.join(args.job_dir, "reports", f"{name}.jsonl"))
+            chunk_settings = settings
+            if settings.get("archive"):
+                # One archive per chunk: nodes can't share one, and a chunk is only marked
+                # done once its archive is closed, so an interrupted chunk is simply redone
+                stem, extension = os.path.splitext(settings["archive"])
+                chunk_settings = dict(settings, archive=f"{stem}_{name}{extension}")
+                archive_path = os.path.join(manifest["output_dir"], chunk_settings["archive"])
+                if os.path.exists(archive_path):
+                    os.remove(archive_path)
+            engine = run_engine(session_pool, chunk_settings, manifest["output_dir"], paths, report,
+                                args.workers)
+        except BaseException:
+            lease.release()
+            raise
+
+        if engine.fatal_error:
+            # Leave the chunk for another node, or a later run of this one
+            lease.release()
+            log(f"Released {name}")
+        else:
+            # Images that failed are listed for shard requeue, retrying the chunk would fail them again
+            write_failures(args.job_dir, lease.index, engine.failed_paths)
+            lease.complete()
+            if engine.failed_paths:
+                log(f"Finished {name}, {len(engine.failed_paths)} images failed")
+            else:
+                log(f"Finished {name}")
+
+
+def command_shard_status(args):
+    """Print how far a sharded job has come"""
+    status = job_status(args.job_dir, args.lease_ttl)
+    print(f"{status['done']}/{status['chunks']} chunks done, {status['running']} running, "
+          f"{status['expired']} expired, {status['waiting']} waiting")
+    if status["failed"]:
+        print(f"{status['failed']} images failed, use shard requeue to queue them again")
+    return 0
+
+
+def command_shard_requeue(args):
+    """Queue the failed images of a sharded job again as new chunks"""
+    requeued = requeue_failures(args.job_dir)
+    log(f"Requeued {requeued} failed images, run shard work again to process them")
+    return 0
+
+
+def add_engine_arguments(parser):
+    """Engine settings shared by run and shard create"""
+    parser.add_argument("inputs", nargs="+", help="Image files or directories")
+    parser.add_argument("-o", "--output", required=True, help="Output directory")
+    parser.add_argument("-m", "--model", default=DEFAULT_MODEL, choices=[AUTO_MODEL] + list(MODEL_PROFILES))
+    parser.add_argument("--suffix", default="_no_bg", help="Appended to output file names")
+    parser.add_argument("--max-size", type=int, default=0, help="Longest output side in pixels, 0 = original")
+    parser.add_argument("--crop", action="store_true", help="Crop outputs to the subject")
+    parser.add_argument("--padding", type=int, default=0, help="Transparent border around outputs in pixels")
+    parser.add_argument("--archive", help="Write outputs into this ZIP archive in the output directory")
+    parser.add_argument("--no-passthrough", action="store_true",
+                        help="Process every image, even ones that are already transparent or have no background")
+    parser.add_argument("--order", default=ORDER_LARGEST_FIRST, choices=JOB_ORDERS)
+    parser.add_argument("--keep-duplicates", action="store_true", help="Process identical images separately")
+    parser.add_argument("--near-duplicates", action="store_true", help="Also match near-identical images")
+    parser.add_argument("--duplicate-mode", default=FANOUT_COPY, choices=[FANOUT_COPY, FANOUT_LINK])
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES, help="Extra attempts after an I/O error")
+    parser.add_argument("--profile", action="store_true",
+                        help="Profile a sample of images, the results are written next to the report")
+    parser.add_argument("--profile-every", type=int, default=DEFAULT_PROFILE_EVERY,
+                        help="Profile one image in this many")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="bgtank", description="BGTANK bulk background remover")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Process images on this machine")
+    add_engine_arguments(run_parser)
+    run_parser.add_argument("-w", "--workers", type=int, default=0, help="Worker threads, 0 = auto")
+    run_parser.add_argument("--fresh", action="store_true", help="Start a new job instead of resuming")
+    run_parser.set_defaults(handler=command_run)
+
+    status_parser = commands.add_parser("status", help="Show the progress of a job")
+    status_parser.add_argument("job", help="Output directory or job store file")
+    status_parser.add_argument("--failed", action="store_true", help="List the quarantined images")
+    status_parser.set_defaults(handler=command_status)
+
+    requeue_parser = commands.add_parser("requeue", help="Queue the failed images of a job again")
+    requeue_parser.add_argument("job", help="Output directory or job store file")
+    requeue_parser.set_defaults(handler=command_requeue)
+
+    shard_parser = commands.add_parser("shard", help="Split a job across render nodes")
+    shard_commands = shard_parser.add_subparsers(dest="shard_command", required=True)
+
+    create_parser = shard_commands.add_parser("create", help="Create a sharded job")
+    create_parser.add_argument("job_dir", help="Job directory on the shared filesystem")
+    add_engine_arguments(create_parser)
+    create_parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Images per chunk")
+    create_parser.set_defaults(handler=command_shard_create)
+
+    work_parser = shard_commands.add_parser("work", help="Process chunks as a render node")
+    work_parser.add_argument("job_dir")
+    work_parser.add_argument("--node", help="Node name, defaults to host and process id")
+    work_parser.add_argument("-w", "--workers", type=int, default=0, help="Worker threads, 0 = auto")
+    work_parser.add_argument("--lease-ttl", type=int, default=DEFAULT_LEASE_TTL,
+                             help="Seconds without a heartbeat before a node's chunk is reclaimed")
+    work_parser.set_defaults(handler=command_shard_work)
+
+    shard_status_parser = shard_commands.add_parser("status", help="Show the progress of a sharded job")
+    shard_status_parser.add_argument("job_dir")
+    shard_status_parser.add_argument("--lease-ttl", type=int, default=DEFAULT_LEASE_TTL)
+    shard_status_parser.set_defaults(handler=command_shard_status)
+
+    shard_requeue_parser = shard_commands.add_parser("requeue", help="Queue the failed images of a sharded job again")
+    shard_requeue_parser.add_argument("job_dir")
+    shard_requeue_parser.set_defaults(handler=command_shard_requeue)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
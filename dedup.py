@@ -0,0 +1,161 @@
+"""
+dedup.py - Duplicate image detection for BGTANK
+
+Finds byte-identical inputs (and optionally near-identical ones with a
+perceptual hash and a small colour thumbnail) before inference, so every unique image is processed once and
+its result is fanned out to the outputs of its duplicates.
+"""
+
+import hashlib
+import os
+import shutil
+from collections import defaultdict
+
+from PIL import Image
+
+from archives import input_size, open_input
+
+HASH_CHUNK_SIZE = 1024 * 1024
+PHASH_SIZE = 8  # dHash grid, gives a 64 bit hash
+PHASH_BANDS = 4  # 16 bit bands used to find candidates without comparing every pair
+PHASH_MAX_DISTANCE = 3  # Max differing bits, must stay below PHASH_BANDS
+COLOR_GRID = 8  # Colour thumbnail compared after a hash match
+COLOR_MAX_DIFFERENCE = 24  # Max difference of any thumbnail channel, recompression stays well below
+
+FANOUT_COPY = "copy"
+FANOUT_LINK = "link"
+
+
+def file_digest(path):
+    """Hash the contents of a file"""
+    digest = hashlib.blake2b(digest_size=20)
+    with open_input(path) as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def perceptual_hash(path):
+    """Compute a 64 bit difference hash, returns (hash, image size, colour thumbnail bytes)
+
+    The hash only sees brightness, the thumbnail tells colour variants of the
+    same shot apart.
+    """
+    with open_input(path) as f, Image.open(f) as image:
+        size = image.size
+        image.draft("RGB", (PHASH_SIZE * 4, PHASH_SIZE * 4))
+        rgb = image.convert("RGB")
+        small = rgb.convert("L").resize((PHASH_SIZE + 1, PHASH_SIZE), Image.BILINEAR)
+        colors = rgb.resize((COLOR_GRID, COLOR_GRID), Image.BOX).tobytes()
+
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(PHASH_SIZE):
+        offset = row * (PHASH_SIZE + 1)
+        for col in range(PHASH_SIZE):
+            value = (value << 1) | (pixels[offset + col + 1] > pixels[offset + col])
+    return value, size, colors
+
+
+def hamming_distance(a, b):
+    """Count the bits that differ between two hashes"""
+    return bin(a ^ b).count("1")
+
+
+def colors_match(a, b):
+    """Check whether two colour thumbnails differ nowhere by more than COLOR_MAX_DIFFERENCE"""
+    return max(abs(x - y) for x, y in zip(a, b)) <= COLOR_MAX_DIFFERENCE
+
+
+def find_duplicates(paths, near=False):
+    """Group duplicate images
+
+    Returns (unique, duplicates): the paths that need processing, in their
+    original order, and a dict mapping each of those to the paths that reuse
+    its result. Unreadable files are left unique so processing reports them.
+    """
+    representative = {}
+
+    # Identical files always have the same size, so only files sharing a size are hashed
+    by_size = defaultdict(list)
+    for path in paths:
+        try:
+            by_size[input_size(path)].append(path)
+        except OSError:
+            continue
+
+    for group in by_size.values():
+        if len(group) < 2:
+            continue
+        seen = {}
+        for path in group:
+            try:
+                digest = file_digest(path)
+            except OSError:
+                continue
+            if digest in seen:
+                representative[path] = seen[digest]
+            else:
+                seen[digest] = path
+
+    # Near duplicates: a match within PHASH_MAX_DISTANCE bits shares at least one band exactly.
+    # Only images with the same dimensions are matched so outputs keep the right size, and only
+    # with the same colours so a colour variant of a product never gets the other one's cutout
+    if near:
+        band_bits = PHASH_SIZE * PHASH_SIZE // PHASH_BANDS
+        band_mask = (1 << band_bits) - 1
+        buckets = defaultdict(list)
+        hashes = {}
+        thumbnails = {}
+
+        for path in paths:
+            if path in representative:
+                continue
+            try:
+                value, size, colors = perceptual_hash(path)
+            except Exception:
+                continue
+
+            keys = [(size, band, (value >> (band * band_bits)) & band_mask) for band in range(PHASH_BANDS)]
+            match = None
+            for key in keys:
+                for candidate in buckets[key]:
+                    if (hamming_distance(value, hashes[candidate]) <= PHASH_MAX_DISTANCE and
+                            colors_match(colors, thumbnails[candidate])):
+                        match = candidate
+                        break
+                if match:
+                    break
+
+            if match:
+                representative[path] = match
+            else:
+                hashes[path] = value
+                thumbnails[path] = colors
+                for key in keys:
+                    buckets[key].append(path)
+
+    duplicates = defaultdict(list)
+    for path in paths:
+        if path in representative:
+            duplicates[representative[path]].append(path)
+
+    unique = [path for path in paths if path not in representative]
+    return unique, dict(duplicates)
+
+
+def fan_out(source, destination, mode=FANOUT_COPY):
+    """Give a duplicate its output by hard linking or copying the processed result"""
+    if os.path.abspath(source) == os.path.abspath(destination):
+        return
+    if os.path.lexists(destination):
+        os.remove(destination)
+
+    if mode == FANOUT_LINK:
+        try:
+            os.link(source, destination)
+            return
+        except OSError:
+            # Different volume or no hard link support, fall back to a copy
+            pass
+    shutil.copyfile(source, destination)
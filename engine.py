@@ -0,0 +1,560 @@
+"""
+engine.py - Batch processing engine for BGTANK
+
+Runs a batch of images through a pool of rembg sessions on a worker pool and
+reports progress as (message_type, message) tuples on a queue, the same
+messages the GUI consumes. Images travel between the read, inference,
+post-processing and write stages as decoded PIL images: inputs are decoded
+straight from a memory map of the file and results are encoded straight into
+the output file.
+"""
+
+import mmap
+import os
+import random
+import shutil
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+from PIL import Image, UnidentifiedImageError
+
+from archives import (ZipOutput, close_readers, is_member, member_path, open_input, output_archive_names,
+                      split_member)
+from dedup import FANOUT_COPY, fan_out, find_duplicates
+from jobstore import DONE, FAILED, PENDING
+from models import AUTO_MODEL, choose_model, display_name, get_profile
+from postprocess import FULL_COVERAGE, finish_output, mask_coverage, output_info, passthrough_reason
+from scheduler import (ORDER_LARGEST_FIRST, MemoryBudget, default_memory_budget, estimate_image_mb, order_jobs,
+                       probe_image_sizes, working_pixels)
+from sessionpool import pool_size
+from throughput import ThroughputTracker
+
+
+MMAP_MIN_SIZE = 64 * 1024  # Smaller files are cheaper to read through the file object
+DECODE_THREADS = min(4, os.cpu_count() or 1)
+STORE_CLAIM_SIZE = 2000  # Items claimed from the job store at a time
+DEFAULT_RETRIES = 2  # Extra attempts for an image that failed with an I/O error
+RETRY_BASE_DELAY = 1.0  # Seconds before the first retry, doubled for every further one
+RETRY_MAX_DELAY = 30.0
+
+_decode_pool = None
+_decode_pool_lock = threading.Lock()
+
+
+def get_decode_pool():
+    """Get the decode thread pool shared by every run"""
+    global _decode_pool
+    with _decode_pool_lock:
+        if _decode_pool is None:
+            _decode_pool = ThreadPoolExecutor(max_workers=DECODE_THREADS, thread_name_prefix="bgtank-decode")
+        return _decode_pool
+
+
+@contextmanager
+def open_source(path):
+    """Open an input file as a memory map, falling back to the plain file object
+
+    Archive members are read from their archive instead.
+    """
+    if is_member(path):
+        with open_input(path) as f:
+            yield f
+        return
+
+    with open(path, "rb") as f:
+        source = None
+        if os.fstat(f.fileno()).st_size >= MMAP_MIN_SIZE:
+            try:
+                source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, OSError):
+                # Some network filesystems can't be mapped
+                source = None
+
+        if source is None:
+            yield f
+            return
+        with source:
+            yield source
+
+
+def decode_image(source, max_size=0):
+    """Decode an image, downscaling during the decode when it is larger than max_size
+
+    JPEGs are decoded with draft mode, which scales by 1/2, 1/4 or 1/8 in the
+    DCT domain, other formats are reduced right after decoding. Returns the
+    image and its original size.
+    """
+    image = Image.open(source)
+    original_size = image.size
+    if max_size and max(image.size) > max_size:
+        scale = max_size / max(image.size)
+        target = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        # Draft never goes below the requested size, thumbnail does the final exact resize
+        image.draft("RGB" if image.mode == "CMYK" else image.mode, target)
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+    image.load()
+    return image, original_size
+
+
+def is_transient_error(error):
+    """Tell I/O errors worth retrying from broken image data that will fail again"""
+    if isinstance(error, (UnidentifiedImageError, Image.DecompressionBombError,
+                          FileNotFoundError, IsADirectoryError, NotADirectoryError)):
+        return False
+    # Covers network share hiccups and "image file is truncated" from a file still being written
+    return isinstance(error, OSError)
+
+
+def retry_delay(attempt):
+    """Exponential backoff with jitter, so retries of many images don't hit a share at once"""
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def run_model(session_pool, image, model_name, session=None):
+    """Run the model on a decoded image and return the RGBA result, borrowing a pooled session"""
+    from rembg import remove
+    with nullcontext(session) if session else session_pool.checkout(model_name) as session:
+        return remove(
+            image,
+            session=session,
+            only_mask=False,
+            alpha_matting=get_profile(model_name).alpha_matting
+        )
+
+
+def relative_input_path(input_path, input_roots):
+    """Path of an input below the input directory it was found in, its file name otherwise"""
+    path = os.path.abspath(input_path)
+    # The deepest root wins when input directories are nested
+    for root in sorted(input_roots, key=len, reverse=True):
+        try:
+            if os.path.commonpath([path, root]) == root:
+                return os.path.relpath(path, root)
+        except ValueError:
+            # Different drives on Windows
+            continue
+    return os.path.basename(path)
+
+
+def output_name(input_path, suffix, extension=".png", input_roots=()):
+    """Name of an input's output relative to the output directory, with / between folders
+
+    Images found in an input directory or archive keep their subdirectory, so
+    images with the same name in different folders don't overwrite each other.
+    """
+    if is_member(input_path):
+        # Archive members keep their folders but not the archive's name. Parts that
+        # would point outside the output directory are dropped
+        parts = split_member(input_path)[1].replace("\\", "/").split("/")
+        relative = "/".join(part for part in parts if part not in ("", ".", ".."))
+    else:
+        relative = relative_input_path(input_path, input_roots).replace(os.sep, "/")
+    return f"{os.path.splitext(relative)[0]}{suffix}{extension}"
+
+
+def requeue_missing_outputs(store, archive_path, suffix, input_roots=()):
+    """Queue done items again whose output is not in the output archive, returns how many
+
+    Items are marked done as soon as their output is added, but an archive is
+    only readable once the run closes it. After an interrupted run, or when
+    the archive was deleted, those outputs are gone and have to be redone.
+    """
+    written = {os.path.splitext(name)[0] for name in output_archive_names(archive_path)}
+    # Kept originals may have another extension than .png, so only the names are compared
+    missing = [path for path in store.paths(DONE)
+               if os.path.splitext(output_name(path, suffix, input_roots=input_roots))[0] not in written]
+    return store.requeue(missing) if missing else 0
+
+
+class BatchEngine:
+    """Removes backgrounds from a batch of images on a pool of worker threads"""
+
+    def __init__(self, session_pool, model_name, output_dir, suffix, message_queue, report,
+                 workers=1, batch_size=1, skip_duplicates=True, match_near_duplicates=False,
+                 duplicate_mode=FANOUT_COPY, max_output_size=0, memory_budget_mb=0,
+                 job_order=ORDER_LARGEST_FIRST, store=None, retries=DEFAULT_RETRIES, profiler=None,
+                 crop_to_subject=False, padding=0, output_archive=None, passthrough=True, input_roots=()):
+        # The pool belongs to this run, a model switch in the GUI builds a new one
+        self.session_pool = session_pool
+        self.session_pool.resize(pool_size(model_name, workers))
+        self.model_name = model_name
+        self.output_dir = output_dir
+        self.suffix = suffix
+        # Input directories, outputs of the images inside keep their subdirectory
+        self.input_roots = [os.path.abspath(root) for root in input_roots]
+        self.queue = message_queue
+        self.report = report
+        self.workers = workers
+        self.batch_size = batch_size
+        self.skip_duplicates = skip_duplicates
+        self.match_near_duplicates = match_near_duplicates
+        self.duplicate_mode = duplicate_mode
+        self.max_output_size = max_output_size
+        self.crop_to_subject = crop_to_subject
+        self.padding = padding
+        # Cropped outputs are decoded in full and fitted to the max size after the crop,
+        # so the subject keeps the detail a downscaled decode would throw away
+        self.decode_size = 0 if crop_to_subject else max_output_size
+        # Inputs with no background to remove keep their original
+        self.passthrough = passthrough
+        self.memory_budget = MemoryBudget(memory_budget_mb or
+                                          default_memory_budget(model_name, session_pool.memory_mb()))
+        self.job_order = job_order
+        self.store = store
+        self.retries = retries
+        self.profiler = profiler
+        # Outputs go into this ZIP archive instead of separate files when set
+        self.output_archive = output_archive
+        self.archive = None
+
+        self.duplicates = {}
+        self.processed_count = 0
+        self.failed_paths = []  # Inputs that failed in this run, duplicates included
+        self.image_sizes = {}
+        self.throughput = ThroughputTracker()
+        self.count_lock = threading.Lock()
+        self.start_time = None
+        self.fatal_error = None
+
+    def run(self, paths=None):
+        """Process all images, meant to run in a background thread
+
+        With a job store the pending items are claimed from the store chunk by
+        chunk and paths is ignored.
+        """
+        self.start_time = datetime.now()
+        total = 0
+        try:
+            if self.output_archive:
+                self.archive = ZipOutput(self.output_archive)
+
+            if self.store is None:
+                total = len(paths)
+                self.process_batch(paths)
+            else:
+                while True:
+                    paths = self.store.claim(STORE_CLAIM_SIZE)
+                    if not paths:
+                        break
+                    total += len(paths)
+                    self.process_batch(paths)
+                self.store.flush()
+
+                failed = self.store.counts()[FAILED]
+                if failed:
+                    self.queue.put(("status", f"{failed} images failed and are quarantined in the job store"))
+
+            # All done
+            self.close_outputs()
+            self.close_report(total)
+            self.queue.put(("completed", None))
+
+        except Exception as e:
+            self.fatal_error = str(e)
+            self.close_outputs()
+            self.close_report(total)
+            self.queue.put(("fatal_error", str(e)))
+
+    def process_batch(self, paths):
+        """Run a list of images through the pipeline and wait until all are finished"""
+        # Find duplicates first so each unique image goes through the model once
+        input_paths = paths
+        self.duplicates = {}
+        if self.skip_duplicates:
+            self.queue.put(("status", "Checking for duplicate images..."))
+            input_paths, self.duplicates = find_duplicates(paths, near=self.match_near_duplicates)
+            duplicate_count = len(paths) - len(input_paths)
+            if duplicate_count:
+                self.queue.put(("status", f"{duplicate_count} duplicates will reuse the result of "
+                                          f"{len(self.duplicates)} images"))
+
+        # Header dimensions drive the job order, memory admission and the size-weighted ETA
+        self.queue.put(("status", "Reading image headers..."))
+        decode_pool = get_decode_pool()
+        self.image_sizes = probe_image_sizes(input_paths, decode_pool)
+        input_paths = order_jobs(input_paths, self.image_sizes, self.job_order, self.decode_size)
+
+        batch_pixels = sum(self.pixel_weight(path) for path in input_paths)
+        if self.store is None:
+            self.throughput.set_total(batch_pixels)
+        else:
+            # Items still in the store are assumed to be the size of this chunk on average
+            pending = self.store.counts()[PENDING]
+            self.throughput.set_total(self.throughput.done_pixels + batch_pixels +
+                                      pending * batch_pixels / max(1, len(input_paths)))
+
+        self.queue.put(("status", f"Memory budget: {self.memory_budget.budget_mb} MB, "
+                                  f"sessions per model: {self.session_pool.size}, job order: {self.job_order}"))
+
+        # Keep at most batch_size images queued per worker so huge jobs don't pile up in memory.
+        # Queued images are decoded ahead on the shared decode pool while the workers run the model
+        max_pending = self.workers * self.batch_size
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bgtank-worker") as executor:
+            pending = set()
+            for input_path in input_paths:
+                if len(pending) >= max_pending:
+                    _, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+                # Admit the image only once its estimated memory fits the budget
+                cost_mb = estimate_image_mb(self.image_sizes.get(input_path), self.model_name,
+                                            self.decode_size)
+                self.memory_budget.acquire(cost_mb)
+
+                decoded = decode_pool.submit(self.load_image, input_path)
+                future = executor.submit(self.process_image, input_path, decoded)
+                future.add_done_callback(lambda _, cost_mb=cost_mb: self.memory_budget.release(cost_mb))
+                pending.add(future)
+            wait(pending)
+
+    def remove_background(self, image, model_name, session=None):
+        """Run the model on a decoded image and return the RGBA result"""
+        return run_model(self.session_pool, image, model_name, session)
+
+    def load_image(self, input_path):
+        """Read and decode an image, runs on the decode pool ahead of the workers
+
+        Returns (image, width, height, model, timings) where width and height
+        are the original dimensions.
+        """
+        timings = {}
+        image_model = self.model_name
+
+        # Decode straight from the mapped file, the header gives the dimensions up front
+        stage_start = time.perf_counter()
+        with open_source(input_path) as source:
+            image, (width, height) = decode_image(source, self.decode_size)
+        timings["read"] = time.perf_counter() - stage_start
+
+        # Auto mode picks the model from a sample of the decoded image, the source is read once
+        if self.model_name == AUTO_MODEL:
+            stage_start = time.perf_counter()
+            image_model = choose_model(image)
+            timings["route"] = time.perf_counter() - stage_start
+
+        return image, width, height, image_model, timings
+
+    def process_image(self, input_path, decoded):
+        """Remove the background from a single image, called from the worker pool"""
+        timings = {}
+        image_model = self.model_name
+        width = height = None
+        output_path = None
+        attempt = 0
+        while True:
+            try:
+                # Wait for the decode pool to hand over the decoded image, retries decode on this thread
+                if attempt == 0:
+                    image, width, height, image_model, timings = decoded.result()
+                else:
+                    image, width, height, image_model, timings = self.load_image(input_path)
+
+                # Inputs that are already cut out skip the model entirely
+                reason = passthrough_reason(image) if self.passthrough else None
+                if reason:
+                    output_path = self.keep_original(input_path, image, (width, height), timings)
+                else:
+                    output_path, reason = self.remove_and_write(input_path, image, image_model, (width, height),
+                                                                timings)
+                image.close()
+
+                if reason:
+                    self.record_result(input_path, output_path, "passthrough", image_model, timings=timings,
+                                       width=width, height=height, retries=attempt, reason=reason)
+                    self.queue.put(("success", f"Kept original: {os.path.basename(input_path)} ({reason})"))
+                else:
+                    self.record_result(input_path, output_path, "done", image_model,
+                                       timings=timings, width=width, height=height, retries=attempt)
+                    self.queue.put(("success", f"Completed: {os.path.basename(input_path)} -> "
+                                               f"{os.path.basename(output_path)}"))
+                break
+
+            except Exception as e:
+                # Only I/O errors get another try, a broken image would fail the same way again
+                if attempt < self.retries and is_transient_error(e):
+                    attempt += 1
+                    delay = retry_delay(attempt)
+                    self.queue.put(("status", f"Retrying {os.path.basename(input_path)} in {delay:.1f}s "
+                                              f"({attempt}/{self.retries}): {str(e)}"))
+                    time.sleep(delay)
+                    continue
+
+                self.record_result(input_path, output_path, "failed", image_model, timings=timings,
+                                   width=width, height=height, error=str(e), retries=attempt)
+                self.queue.put(("error", f"Error ({os.path.basename(input_path)}): {str(e)}"))
+                output_path = None
+                break
+
+        # Hand the result to every duplicate of this image
+        for duplicate_path in self.duplicates.get(input_path, []):
+            self.fan_out_duplicate(input_path, output_path, duplicate_path, image_model, width, height)
+
+        # Update progress and time estimate via queue
+        self.count_processed(1 + len(self.duplicates.get(input_path, [])), self.pixel_weight(input_path), timings)
+
+    def remove_and_write(self, input_path, image, image_model, original_size, timings):
+        """Run the model on a decoded image and write the result, returns (output path, passthrough reason)
+
+        The reason is None unless the mask kept the whole frame and the
+        original was kept instead.
+        """
+        # Update status via queue
+        self.queue.put(("status", f"Processing with {display_name(image_model)}: "
+                                  f"{os.path.basename(input_path)}"))
+
+        # Sampled images run under the profiler when profiling is on
+        sample = self.profiler.sample(image_model) if self.profiler else nullcontext()
+        with sample as profiled_session:
+            # Remove background, the decoded image is handed over without re-encoding
+            stage_start = time.perf_counter()
+            result = self.remove_background(image, image_model, profiled_session)
+            timings["inference"] = time.perf_counter() - stage_start
+
+            # A mask that keeps the whole frame removed nothing, the original is kept instead
+            if self.passthrough and mask_coverage(result) >= FULL_COVERAGE:
+                result.close()
+                return self.keep_original(input_path, image, original_size, timings), "no background found"
+
+            # Crop, pad and resize in one pass before the single encode
+            if self.crop_to_subject or self.padding:
+                stage_start = time.perf_counter()
+                finished = finish_output(result, self.crop_to_subject, self.padding, self.max_output_size)
+                if finished is not result:
+                    result.close()
+                    result = finished
+                timings["postprocess"] = time.perf_counter() - stage_start
+
+            # Encode the result straight into the output file
+            output_path = self.output_path_for(input_path)
+            stage_start = time.perf_counter()
+            self.write_output(result, output_path)
+            result.close()
+            timings["write"] = time.perf_counter() - stage_start
+        return output_path, None
+
+    def output_path_for(self, input_path, extension=".png"):
+        """Build the output path for an input image, creating its subdirectory in the output directory"""
+        name = output_name(input_path, self.suffix, extension, self.input_roots)
+        if self.output_archive:
+            return member_path(self.output_archive, name)
+        output_path = os.path.join(self.output_dir, *name.split("/"))
+        if "/" in name:
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        return output_path
+
+    def write_output(self, result, output_path):
+        """Encode a result into its output file or the output archive"""
+        if self.archive:
+            self.archive.write(split_member(output_path)[1], result, pnginfo=output_info())
+        else:
+            result.save(output_path, "PNG", pnginfo=output_info())
+
+    def keep_original(self, input_path, image, original_size, timings):
+        """Give an image with no background to remove its original as output, returns the output path
+
+        The file is copied (or linked, like duplicates) as it is, keeping its
+        format. Only when the size cap or post-processing would change it is
+        the decoded image encoded instead, still without running the model.
+        """
+        stage_start = time.perf_counter()
+        changed = (self.crop_to_subject or self.padding or image.size != original_size or
+                   (self.max_output_size and max(image.size) > self.max_output_size))
+        if changed:
+            result = finish_output(image.convert("RGBA"), self.crop_to_subject, self.padding,
+                                   self.max_output_size)
+            output_path = self.output_path_for(input_path)
+            self.write_output(result, output_path)
+            result.close()
+        else:
+            name = split_member(input_path)[1] if is_member(input_path) else input_path
+            output_path = self.output_path_for(input_path, os.path.splitext(name)[1].lower())
+            self.copy_input(input_path, output_path)
+        timings["write"] = time.perf_counter() - stage_start
+        return output_path
+
+    def copy_input(self, input_path, output_path):
+        """Copy an input file or archive member to its output unchanged"""
+        if self.archive:
+            with open_input(input_path) as f:
+                self.archive.write_bytes(split_member(output_path)[1], f.read())
+        elif is_member(input_path):
+            with open_input(input_path) as source, open(output_path, "wb") as destination:
+                shutil.copyfileobj(source, destination)
+        else:
+            fan_out(input_path, output_path, self.duplicate_mode)
+
+    def fan_out_duplicate(self, source_path, source_output, duplicate_path, image_model, width, height):
+        """Give a duplicate image the output of the image it duplicates"""
+        # A kept original may have another format than the usual PNG
+        output_path = self.output_path_for(duplicate_path,
+                                           os.path.splitext(source_output)[1] if source_output else ".png")
+        try:
+            if source_output is None:
+                raise RuntimeError(f"duplicate of failed image {os.path.basename(source_path)}")
+
+            stage_start = time.perf_counter()
+            if self.archive:
+                self.archive.copy(split_member(source_output)[1], split_member(output_path)[1])
+            else:
+                fan_out(source_output, output_path, self.duplicate_mode)
+            timings = {"write": time.perf_counter() - stage_start}
+
+            self.record_result(duplicate_path, output_path, "duplicate", image_model, timings=timings,
+                               width=width, height=height, duplicate_of=source_path)
+            self.queue.put(("success", f"Duplicate: {os.path.basename(duplicate_path)} -> "
+                                       f"{os.path.basename(output_path)}"))
+        except Exception as e:
+            self.record_result(duplicate_path, None, "failed", image_model, width=width, height=height,
+                               error=str(e), duplicate_of=source_path)
+            self.queue.put(("error", f"Error ({os.path.basename(duplicate_path)}): {str(e)}"))
+
+    def record_result(self, input_path, output_path, status, model, timings=None, width=None, height=None,
+                      error=None, retries=0, **extra):
+        """Write an image's outcome to the run report and the job store"""
+        if status == "failed":
+            with self.count_lock:
+                self.failed_paths.append(input_path)
+        if retries:
+            extra["retries"] = retries
+        self.report.write_image(input_path, output_path, status, model, timings=timings,
+                                width=width, height=height, error=error, **extra)
+        if self.store is not None:
+            seconds = round(sum(timings.values()), 4) if timings else None
+            self.store.finish(input_path, FAILED if status == "failed" else DONE, seconds, error, retries)
+
+    def pixel_weight(self, input_path):
+        """Pixels an image is processed at, its share of the total work"""
+        return working_pixels(self.image_sizes.get(input_path), self.decode_size)
+
+    def count_processed(self, count, pixels, timings=None):
+        """Advance the progress counter and throughput tracker from a worker thread"""
+        self.throughput.record(count, pixels, timings)
+        with self.count_lock:
+            self.processed_count += count
+            self.queue.put(("progress", self.processed_count))
+        self.queue.put(("update_time", None))
+
+    def close_outputs(self):
+        """Finish the output archive and let go of the input archives"""
+        if self.archive:
+            archive, self.archive = self.archive, None
+            archive.close()
+        close_readers()
+
+    def close_report(self, total):
+        """Write the run summary and close the report file"""
+        if self.report:
+            elapsed = (datetime.now() - self.start_time).total_seconds()
+            self.report.close(total=total, elapsed=round(elapsed, 3),
+                              model=self.model_name, output_dir=self.output_dir)
+
+        if self.profiler:
+            try:
+                summary_path = self.profiler.close()
+                if summary_path:
+                    self.queue.put(("status", f"Profile summary: {summary_path}"))
+            except Exception as e:
+                self.queue.put(("error", f"Could not write the profile: {str(e)}"))
@@ -0,0 +1,155 @@
+"""
+environment.py - Environment readiness checks shared by BGTANK's entry points
+
+BGTANK.py, launcher.py and main.py all need to know whether the virtual
+environment has what the app needs. This module answers that once: the
+launcher records a stamp of requirements.txt and the interpreter version after
+a successful install, and passes the verified stamp on to the app, which then
+trusts it instead of probing packages again. The app signals the process that
+started it through a ready file once its window is up. Only the standard
+library is used so it works before anything is installed.
+"""
+
+import hashlib
+import importlib.util
+import os
+import platform
+import sys
+import time
+
+STAMP_NAME = "bgtank_environment.stamp"
+READY_ENV_VAR = "BGTANK_ENVIRONMENT_READY"  # Set by the launcher to the stamp it verified
+READY_FILE_ENV_VAR = "BGTANK_READY_FILE"  # Created by the app once its window is up
+READY_POLL_INTERVAL = 0.05
+
+# Modules the app imports at runtime, mapped to the package that provides them
+REQUIRED_MODULES = {
+    "rembg": "rembg",
+    "onnxruntime": "onnxruntime",
+    "numpy": "numpy",
+    "PIL": "Pillow",
+}
+
+_missing_cache = None
+
+
+def get_app_dir():
+    """Directory the app files live in"""
+    if getattr(sys, "frozen", False):
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
+
+
+def get_venv_dir(base_dir=None):
+    return os.path.join(base_dir or get_app_dir(), ".venv")
+
+
+def get_venv_python(base_dir=None):
+    """Path of the venv's interpreter"""
+    if platform.system() == "Windows":
+        return os.path.join(get_venv_dir(base_dir), "Scripts", "python.exe")
+    return os.path.join(get_venv_dir(base_dir), "bin", "python")
+
+
+def get_venv_python_version(base_dir=None):
+    """Read the interpreter version of the venv from pyvenv.cfg without starting it"""
+    try:
+        with open(os.path.join(get_venv_dir(base_dir), "pyvenv.cfg"), encoding="utf-8") as f:
+            for line in f:
+                key, _, value = line.partition("=")
+                if key.strip() in ("version", "version_info"):
+                    return value.strip()
+    except OSError:
+        pass
+    return platform.python_version()
+
+
+def environment_stamp(base_dir=None):
+    """Fingerprint of the environment: the requirements and the interpreter that runs the app"""
+    with open(os.path.join(base_dir or get_app_dir(), "requirements.txt"), "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    return f"{digest} python-{get_venv_python_version(base_dir)}"
+
+
+def read_stamp(base_dir=None):
+    """Stamp written by the last successful install, None if there is none"""
+    try:
+        with open(os.path.join(get_venv_dir(base_dir), STAMP_NAME), encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def write_stamp(stamp, base_dir=None):
+    """Remember that the venv satisfies the current requirements"""
+    with open(os.path.join(get_venv_dir(base_dir), STAMP_NAME), "w", encoding="utf-8") as f:
+        f.write(stamp)
+
+
+def stamp_matches(base_dir=None):
+    """Check whether the venv was set up for exactly the current requirements"""
+    try:
+        stamp = environment_stamp(base_dir)
+    except OSError:
+        return False
+    return read_stamp(base_dir) == stamp
+
+
+def running_in_venv(base_dir=None):
+    """Check whether this process runs on the app's own venv"""
+    try:
+        return os.path.samefile(sys.prefix, get_venv_dir(base_dir))
+    except OSError:
+        return False
+
+
+def missing_packages(refresh=False):
+    """Packages the app needs that aren't importable, cached for the life of the process
+
+    When the launcher verified the environment, the check costs nothing.
+    """
+    global _missing_cache
+    if _missing_cache is not None and not refresh:
+        return list(_missing_cache)
+
+    verified = os.environ.get(READY_ENV_VAR)
+    if not refresh and verified and verified == read_stamp():
+        _missing_cache = []
+    else:
+        _missing_cache = [package for module, package in REQUIRED_MODULES.items()
+                          if importlib.util.find_spec(module) is None]
+    return list(_missing_cache)
+
+
+def mark_ready(base_dir=None):
+    """Check the packages again after an install and stamp the venv if this process runs on it"""
+    if missing_packages(refresh=True) or not running_in_venv(base_dir):
+        return False
+    try:
+        write_stamp(environment_stamp(base_dir), base_dir)
+    except OSError:
+        return False
+    return True
+
+
+def signal_ready():
+    """Tell the process that started the app that the window is up"""
+    path = os.environ.pop(READY_FILE_ENV_VAR, None)
+    if path:
+        try:
+            open(path, "w").close()
+        except OSError:
+            pass
+
+
+def wait_until_ready(process, ready_path, timeout):
+    """Wait for the app's ready file, False if the process exited before creating it"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if os.path.exists(ready_path):
+            return True
+        if process.poll() is not None:
+            return False
+        time.sleep(READY_POLL_INTERVAL)
+    # Still running, most likely a first launch that is installing packages
+    return process.poll() is None
@@ -0,0 +1,177 @@
+"""
+jobstore.py - Persistent job queue for BGTANK
+
+Keeps every item of a job in a SQLite database in the output directory, with
+its state (pending, running, done or failed), attempt count and timings. The
+engine claims pending items in chunks instead of holding the whole job in
+memory, so a job of millions of images survives restarts and can be resumed.
+Items that keep failing stay quarantined in the failed state until they are
+requeued.
+Per-state counts are kept up to date by triggers, so progress queries are
+instant no matter how large the job is.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+JOB_STORE_NAME = "bgtank_job.sqlite"
+COMMIT_BATCH = 256  # Finished items buffered before they are written in one transaction
+COMMIT_INTERVAL = 1.0  # Seconds a finished item may wait in the buffer
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+STATES = (PENDING, RUNNING, DONE, FAILED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    started REAL,
+    finished REAL,
+    seconds REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS items_by_state ON items (state, id);
+
+CREATE TABLE IF NOT EXISTS state_counts (
+    state TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO state_counts VALUES ('pending', 0), ('running', 0), ('done', 0), ('failed', 0);
+
+CREATE TRIGGER IF NOT EXISTS count_insert AFTER INSERT ON items BEGIN
+    UPDATE state_counts SET count = count + 1 WHERE state = NEW.state;
+END;
+CREATE TRIGGER IF NOT EXISTS count_delete AFTER DELETE ON items BEGIN
+    UPDATE state_counts SET count = count - 1 WHERE state = OLD.state;
+END;
+CREATE TRIGGER IF NOT EXISTS count_update AFTER UPDATE OF state ON items WHEN OLD.state <> NEW.state BEGIN
+    UPDATE state_counts SET count = count - 1 WHERE state = OLD.state;
+    UPDATE state_counts SET count = count + 1 WHERE state = NEW.state;
+END;
+"""
+
+
+def job_store_path(output_dir):
+    """Location of the job store of an output directory"""
+    return os.path.join(output_dir, JOB_STORE_NAME)
+
+
+class JobStore:
+    """SQLite job queue shared by the engine's threads and the GUI"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.finished = []
+        self.last_commit = time.monotonic()
+
+        # Autocommit mode, transactions are opened explicitly so writes can be batched
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        # WAL lets status queries from other processes read while the job writes
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def add(self, paths):
+        """Queue paths as pending items, paths already in the job keep their state"""
+        with self.lock:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("INSERT OR IGNORE INTO items (path) VALUES (?)", ((path,) for path in paths))
+            self.conn.execute("COMMIT")
+
+    def reset(self):
+        """Drop every item to start a new job"""
+        with self.lock:
+            self.finished = []
+            self.conn.execute("DELETE FROM items")
+
+    def recover(self):
+        """Requeue items left running by an interrupted run, returns how many"""
+        with self.lock:
+            return self.conn.execute("UPDATE items SET state = ? WHERE state = ?", (PENDING, RUNNING)).rowcount
+
+    def claim(self, limit):
+        """Mark up to limit pending items as running and return their paths"""
+        with self.lock:
+            self._commit_finished()
+            # IMMEDIATE takes the write lock up front so two claimers can't pick the same items
+            self.conn.execute("BEGIN IMMEDIATE")
+            rows = self.conn.execute("SELECT id, path FROM items WHERE state = ? ORDER BY id LIMIT ?",
+                                     (PENDING, limit)).fetchall()
+            now = time.time()
+            self.conn.executemany("UPDATE items SET state = ?, attempts = attempts + 1, started = ? WHERE id = ?",
+                                  ((RUNNING, now, item_id) for item_id, _ in rows))
+            self.conn.execute("COMMIT")
+            return [path for _, path in rows]
+
+    def finish(self, path, state, seconds=None, error=None, retries=0):
+        """Record the outcome of an item, writes are batched into one transaction"""
+        with self.lock:
+            self.finished.append((state, retries, time.time(), seconds, error, path))
+            if len(self.finished) >= COMMIT_BATCH or time.monotonic() - self.last_commit >= COMMIT_INTERVAL:
+                self._commit_finished()
+
+    def flush(self):
+        """Write buffered outcomes now"""
+        with self.lock:
+            self._commit_finished()
+
+    def _commit_finished(self):
+        """Write buffered outcomes, called with the lock held"""
+        self.last_commit = time.monotonic()
+        if not self.finished:
+            return
+        self.conn.execute("BEGIN")
+        self.conn.executemany("UPDATE items SET state = ?, attempts = attempts + ?, finished = ?, seconds = ?, "
+                              "error = ? WHERE path = ?", self.finished)
+        self.conn.execute("COMMIT")
+        self.finished = []
+
+    def requeue_failed(self):
+        """Move every quarantined item back to pending, returns how many"""
+        with self.lock:
+            self._commit_finished()
+            return self.conn.execute("UPDATE items SET state = ?, error = NULL WHERE state = ?",
+                                     (PENDING, FAILED)).rowcount
+
+    def requeue(self, paths):
+        """Move done items back to pending, returns how many"""
+        with self.lock:
+            self._commit_finished()
+            self.conn.execute("BEGIN")
+            count = self.conn.executemany("UPDATE items SET state = ? WHERE path = ? AND state = ?",
+                                          ((PENDING, path, DONE) for path in paths)).rowcount
+            self.conn.execute("COMMIT")
+            return count
+
+    def failures(self):
+        """Quarantined items as (path, attempts, error), in the order they were added"""
+        with self.lock:
+            return self.conn.execute("SELECT path, attempts, error FROM items WHERE state = ? ORDER BY id",
+                                     (FAILED,)).fetchall()
+
+    def counts(self):
+        """Number of items in each state"""
+        with self.lock:
+            counts = dict.fromkeys(STATES, 0)
+            counts.update(self.conn.execute("SELECT state, count FROM state_counts"))
+            return counts
+
+    def paths(self, state):
+        """Paths of the items in a state, in the order they were added"""
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT path FROM items WHERE state = ? ORDER BY id",
+                                                        (state,))]
+
+    def close(self):
+        """Write buffered outcomes and close the database"""
+        with self.lock:
+            self._commit_finished()
+            self.conn.close()
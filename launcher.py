@@ -3,6 +3,7 @@
 
 import os
 import sys
+import argparse
 import subprocess
 import platform
 import time
@@ -11,32 +12,41 @@ import shutil
 
 # Original BGTANK constants
 REPO_URL = "https://github.com/verlorengest/BGTANK.git"
-FILES = ["launcher.py", "main.py", "requirements.txt", "icon.ico"]
+FILES = ["launcher.py", "main.py", "cli.py", "archives.py", "dedup.py", "engine.py", "environment.py", "jobstore.py", "models.py", "modelstore.py", "postprocess.py", "preview.py", "profiling.py", "providers.py", "report.py", "scheduler.py", "sessionpool.py", "sharding.py", "throughput.py", "requirements.txt", "icon.ico"]
 
 
-def ensure_colorama():
-    """Check if colorama is installed, and install it if not."""
+def init_colorama():
+    """Turn on colored output if colorama is installed"""
+    global has_colorama, Fore, Style
     try:
         import colorama
-        return True
+        from colorama import Fore, Style
     except ImportError:
-        print("Colorama not found. Attempting to install...")
-        try:
-            subprocess.check_call([sys.executable, "-m", "pip", "install", "colorama"])
-            print("Colorama installed successfully.")
-            return True
-        except subprocess.CalledProcessError:
-            print("Failed to install colorama. Will continue without color formatting.")
-            return False
+        return False
 
+    colorama.init(autoreset=True)
+    has_colorama = True
+    return True
 
-# Initialize colorama if available
-has_colorama = ensure_colorama()
-if has_colorama:
-    import colorama
-    from colorama import Fore, Style
 
-    colorama.init(autoreset=True)
+def ensure_colorama():
+    """Check if colorama is installed, and install it if not."""
+    if has_colorama:
+        return True
+    print("Colorama not found. Attempting to install...")
+    try:
+        subprocess.check_call([sys.executable, "-m", "pip", "install", "colorama"])
+        print("Colorama installed successfully.")
+        return init_colorama()
+    except subprocess.CalledProcessError:
+        print("Failed to install colorama. Will continue without color formatting.")
+        return False
+
+
+# Initialize colorama if available, it is only installed while the environment is being set up
+has_colorama = False
+Fore = Style = None
+init_colorama()
 
 
 def print_centered(message, width=80, padding_char="="):
@@ -147,6 +157,14 @@ def get_venv_activate_path():
         return os.path.join(".venv", "bin", "activate")
 
 
+def get_venv_python():
+    """Get the path to the venv's interpreter based on the platform"""
+    if platform.system() == "Windows":
+        return os.path.join(".venv", "Scripts", "python.exe")
+    else:  # Unix-like (Linux, macOS)
+        return os.path.join(".venv", "bin", "python")
+
+
 def install_requirements(use_venv=True):
     """Install requirements from requirements.txt"""
     print_status("Installing requirements...", "STEP")
@@ -172,19 +190,24 @@ def run_main(use_venv=True):
     print_centered("LAUNCHING APPLICATION")
     print_status("Starting application...", "STEP")
 
-    if use_venv:
-        if platform.system() == "Windows":
-            cmd = f"call {get_venv_activate_path()} && python main.py"
-        else:
-            cmd = f"source {get_venv_activate_path()} && python main.py"
-    else:
-        cmd = f"{sys.executable} main.py"
+    # Run the venv's interpreter directly, activating the venv in a shell only costs time
+    python_exe = get_venv_python() if use_venv else sys.executable
+    cmd = [python_exe, "main.py"]
 
-    return run_command(cmd)
+    if platform.system() != "Windows":
+        # Replace the launcher process instead of keeping it idle next to the app
+        sys.stdout.flush()
+        os.execv(python_exe, cmd)
+    return subprocess.call(cmd)
 
 
 def main():
     """Main function combining functionality from both original scripts"""
+    parser = argparse.ArgumentParser(description="BGTANK launcher")
+    parser.add_argument("--update", action="store_true",
+                        help="Check for and install requirement updates even if nothing changed")
+    args = parser.parse_args()
+
     # Change to the base directory to ensure relative paths work correctly
     base_dir = get_base_dir()
     os.chdir(base_dir)
@@ -192,6 +215,9 @@ def main():
     # Ensure all required files are present
     ensure_files(base_dir)
 
+    # Imported after the file sync so a missing environment.py can be restored first
+    import environment
+
     # Clear screen and show launcher info
     os.system('cls' if platform.system() == 'Windows' else 'clear')
     print_centered("BGTANK LAUNCHER", width=60)
@@ -226,14 +252,29 @@ def main():
     else:
         print_status("Virtual environment found.", "SUCCESS")
 
-    # Check internet connection
-    online = check_internet()
+    # Skip the network check and pip when the venv was already set up for these requirements
+    stamp = environment.environment_stamp(base_dir) if has_requirements and use_venv else None
+    if stamp and not args.update and environment.read_stamp(base_dir) == stamp:
+        print_status("Requirements unchanged. Skipping dependency check (use --update to force).", "SUCCESS")
+        # The app trusts this instead of probing its packages again
+        os.environ[environment.READY_ENV_VAR] = stamp
+    elif has_requirements:
+        ensure_colorama()
+
+        # Check internet connection
+        online = check_internet()
 
-    # Install requirements if they exist and we have internet
-    if has_requirements:
+        # Install requirements if we have internet
         if online:
             print_status("Internet connection detected.", "SUCCESS")
-            if not install_requirements(use_venv):
+            if install_requirements(use_venv):
+                if stamp:
+                    try:
+                        environment.write_stamp(stamp, base_dir)
+                        os.environ[environment.READY_ENV_VAR] = stamp
+                    except OSError as e:
+                        print_status(f"Could not write environment stamp: {str(e)}", "WARNING")
+            else:
                 print_status("Failed to install with venv. Trying system Python...", "WARNING")
                 if not install_requirements(use_venv=False):
                     print_status("Could not install requirements. Attempting to run anyway.", "WARNING")
@@ -1,56 +1,113 @@
 import os
 import sys
-import re 
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from PIL import Image, ImageTk
 import threading
 import queue
 import subprocess
-import importlib.util
+import sqlite3
+import logging
+import time
+from collections import deque
 from datetime import datetime
+from logging.handlers import RotatingFileHandler
 import webbrowser
-import torch
-import numpy as np
-from rembg.bg import download_models
 
+from environment import get_app_dir, mark_ready, missing_packages, signal_ready
+
+# Everything below needs the requirements. Without them the app can't be created,
+# so __main__ offers the install with the standard library only
+try:
+    from PIL import Image, ImageTk
+    from archives import DEFAULT_OUTPUT_ARCHIVE, archive_images, is_archive
+    from dedup import FANOUT_COPY, FANOUT_LINK
+    from engine import DEFAULT_RETRIES, BatchEngine, requeue_missing_outputs
+    from jobstore import DONE, FAILED, PENDING, JobStore, job_store_path
+    from models import (AUTO_MODEL, DEFAULT_MODEL, MODEL_PROFILES, default_batch_size, default_workers,
+                        describe_model, display_name, models_for)
+    from modelstore import is_downloaded
+    from preview import render_previews, sample_paths
+    from profiling import RunProfiler
+    from report import RunReport, report_path_for
+    from scheduler import JOB_ORDERS, ORDER_LARGEST_FIRST, default_memory_budget
+    from sessionpool import SessionPool
+except ImportError as e:
+    IMPORT_ERROR = e
+else:
+    IMPORT_ERROR = None
+
+
+# Status log settings
+LOG_DIR = os.path.join(os.path.expanduser("~"), ".bgtank")
+LOG_FILE = os.path.join(LOG_DIR, "bgtank.log")
+LOG_FILE_MAX_BYTES = 10 * 1024 * 1024  # Rotate the full log every 10 MB
+LOG_FILE_BACKUPS = 5
+MAX_LOG_LINES = 1000  # Lines kept in the on-screen status log
+LOG_FLUSH_INTERVAL_MS = 100  # Pending log lines are inserted once per frame
+QUEUE_POLL_INTERVAL_MS = 100
+QUEUE_TIME_BUDGET = 0.02  # Seconds spent draining the queue per poll
+
+
+def setup_file_logger():
+    """Create the logger that streams the full status log to a rotating file"""
+    logger = logging.getLogger("bgtank")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    if not logger.handlers:
+        try:
+            os.makedirs(LOG_DIR, exist_ok=True)
+            handler = RotatingFileHandler(
+                LOG_FILE,
+                maxBytes=LOG_FILE_MAX_BYTES,
+                backupCount=LOG_FILE_BACKUPS,
+                encoding="utf-8"
+            )
+            handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+            logger.addHandler(handler)
+        except OSError:
+            # Logging to disk is best effort, the on-screen log still works
+            logger.addHandler(logging.NullHandler())
+
+    return logger
+
+def install_missing_packages(root, error):
+    """Offer to install the requirements when the app's own imports failed, returns True once installed
+
+    Runs before the app exists, so only the standard library is used. The app
+    is started again in a new process after a successful install.
+    """
+    root.withdraw()
+    missing = ", ".join(missing_packages(refresh=True)) or error.name or str(error)
+    if not messagebox.askyesno(
+            "Missing Dependencies",
+            f"BGTANK can't start without these packages: {missing}\n\n"
+            f"Install them now? This may take a few minutes."):
+        return False
+
+    root.title("BGTANK")
+    ttk.Label(root, text="Installing requirements...").pack(padx=40, pady=20)
+    root.deiconify()
+    root.update()
+    process = subprocess.run(
+        [sys.executable, '-m', 'pip', 'install', '-r', os.path.join(get_app_dir(), "requirements.txt")],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True
+    )
+    root.withdraw()
+
+    # Check again and stamp the venv so the launcher won't run pip next time
+    mark_ready()
+    missing_deps = missing_packages()
+    if process.returncode != 0 or missing_deps:
+        details = process.stderr.strip()[-1000:] or f"Still missing: {', '.join(missing_deps)}"
+        messagebox.showerror("Error", f"Failed to install requirements:\n{details}")
+        return False
+
+    subprocess.Popen([sys.executable] + sys.argv)
+    return True
 
-class StdErrRedirector:
-    """Redirects console output to queue for progress bar"""
-    def __init__(self, queue):
-        self.queue = queue
-        self.buffer = ""
-        
-    def write(self, text):
-        # Add to buffer
-        self.buffer += text
-        
-        # Only process if we find a percentage symbol or newline
-        if '%' in self.buffer or '\r' in self.buffer:
-            # Look for number followed by % (e.g., "15%" or "100%")
-            # This regex finds the LAST percentage in the text chunk
-            matches = re.findall(r'(\d+)%', self.buffer)
-            
-            if matches:
-                try:
-                    # Get the last reported percentage
-                    percent = int(matches[-1])
-                    
-                    # Try to find time remaining (e.g., "00:05<00:00")
-                    # Looks for format: digits:digits<
-                    time_match = re.search(r'(\d+:\d+)<', self.buffer)
-                    time_left = time_match.group(1) if time_match else "Calculating..."
-                    
-                    self.queue.put(("download_progress", (percent, time_left)))
-                except ValueError:
-                    pass
-            
-            # Keep buffer reasonable size if it gets too long without clearing
-            if len(self.buffer) > 200:
-                self.buffer = self.buffer[-50:]
-
-    def flush(self):
-        pass
 
 class BackgroundRemoverApp:
     def __init__(self, root):
@@ -222,33 +279,28 @@ class BackgroundRemoverApp:
         model_label = ttk.Label(model_frame, text="Background Removal Model:")
         model_label.pack(side=tk.LEFT, padx=(0, 5))
 
-        self.model_var = tk.StringVar(value="birefnet-general")
-
-        # Create radio buttons for model selection
-        self.rb_birefnet = ttk.Radiobutton(
-            model_frame,
-            text="BiRefNet (High accuracy, slower)",
-            variable=self.model_var,
-            value="birefnet-general"
-        )
-        self.rb_birefnet.pack(side=tk.LEFT, padx=(0, 10))
+        self.model_var = tk.StringVar(value=DEFAULT_MODEL)
 
-        self.rb_u2net = ttk.Radiobutton(
+        # Model selection, every model in the registry plus auto routing
+        self.model_combo = ttk.Combobox(
             model_frame,
-            text="U2Net (Faster, lower accuracy)",
-            variable=self.model_var,
-            value="u2net"
+            textvariable=self.model_var,
+            values=[AUTO_MODEL] + list(MODEL_PROFILES),
+            state="readonly",
+            width=28
         )
-        self.rb_u2net.pack(side=tk.LEFT)
+        self.model_combo.pack(side=tk.LEFT)
+        self.model_combo.bind("<<ComboboxSelected>>", lambda e: self.update_model_description())
 
-        # Add tooltip or helper text
-        model_tooltip = ttk.Label(
+        # Helper text describing the selected model's profile
+        self.model_tooltip = ttk.Label(
             settings_frame,
-            text="• BiRefNet: High-quality results with better edge detection but slower processing.\n• U2Net: Faster processing with good results for simple backgrounds.",
+            text=describe_model(DEFAULT_MODEL),
             font=('Segoe UI', 8),
-            foreground="#666666"
+            foreground="#666666",
+            wraplength=620
         )
-        model_tooltip.pack(fill=tk.X, padx=15, pady=(0, 10))
+        self.model_tooltip.pack(fill=tk.X, padx=15, pady=(0, 10))
 
         # Save settings button
         self.btn_save_settings = ttk.Button(
@@ -287,8 +339,12 @@ class BackgroundRemoverApp:
         self.progress.pack(fill=tk.X)
 
         # Progress percentage
+        # Per-stage time breakdown
+        self.stage_label = ttk.Label(progress_frame, text="", font=('Segoe UI', 8), foreground="#666666")
+        self.stage_label.pack(side=tk.LEFT, pady=(5, 0))
+
         self.progress_percentage = ttk.Label(progress_frame, text="0%")
-        self.progress_percentage.pack(pady=(5, 0), anchor=tk.E)
+        self.progress_percentage.pack(side=tk.RIGHT, pady=(5, 0))
 
         # Buttons frame
         button_frame = ttk.Frame(main_frame, style="TFrame")
@@ -303,6 +359,25 @@ class BackgroundRemoverApp:
         )
         self.btn_select.pack(side=tk.LEFT, padx=(0, 10))
 
+        # Advanced settings button
+        self.btn_advanced = ttk.Button(
+            button_frame,
+            text="Advanced",
+            command=self.show_advanced_settings,
+            style="Accent.TButton"
+        )
+        self.btn_advanced.pack(side=tk.LEFT)
+
+        # Preview button
+        self.btn_preview = ttk.Button(
+            button_frame,
+            text="Preview",
+            command=self.show_preview,
+            state=tk.DISABLED,
+            style="Accent.TButton"
+        )
+        self.btn_preview.pack(side=tk.LEFT, padx=(10, 0))
+
         # Process button
         self.btn_process = ttk.Button(
             button_frame,
@@ -356,6 +431,12 @@ class BackgroundRemoverApp:
         self.status_text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         self.status_text.config(state=tk.DISABLED)
 
+        # Configure text tags once instead of on every message
+        self.status_text.tag_config("timestamp", foreground="#666666")
+        self.status_text.tag_config("normal", foreground=self.text_color)
+        self.status_text.tag_config("success", foreground=self.success_color)
+        self.status_text.tag_config("error", foreground=self.error_color)
+
         # Scrollbar for status text
         scrollbar = ttk.Scrollbar(status_text_frame, orient=tk.VERTICAL, command=self.status_text.yview)
         self.status_text.configure(yscrollcommand=scrollbar.set)
@@ -371,12 +452,43 @@ class BackgroundRemoverApp:
         self.suffix = "_no_bg"  # Default suffix
         self.queue = queue.Queue()
         self.is_processing = False
-        self.model_name = "birefnet-general"  # Default model
-
-        self.session = None
+        self.model_name = DEFAULT_MODEL
+        self.worker_setting = 0  # 0 derives the worker count from the model profile
+        self.workers = 1
+        self.batch_size = 1
+        self.skip_duplicates = True
+        self.match_near_duplicates = False
+        self.duplicate_mode = FANOUT_COPY
+        self.max_output_size = 0  # Longest output side in pixels, 0 keeps the original size
+        self.crop_to_subject = False
+        self.padding = 0  # Transparent border around the output in pixels
+        self.zip_output = False  # Write outputs into a ZIP archive in the output folder
+        self.passthrough = True  # Keep originals that have no background to remove
+        self.memory_budget_mb = 0  # 0 derives the budget from the machine's RAM
+        self.job_order = ORDER_LARGEST_FIRST
+        self.retries = DEFAULT_RETRIES
+        self.profile_runs = False
+        self.engine = None
+        self.preview_window = None
+        self.preview_cancel = None  # Stops the preview thread, also tells its results apart
+        self.preview_pending = False  # Open the preview once the selected model has loaded
+
+        self.session_pool = None  # Sessions of the loaded model, handed to each run
+        self.report = None
+        self.job_store = None
         self.start_time = None
         self.processed_count = 0
 
+        # Status log: the widget keeps the last max_log_lines lines, the file log keeps everything
+        self.logger = setup_file_logger()
+        self.max_log_lines = MAX_LOG_LINES
+        self.pending_log = deque(maxlen=self.max_log_lines)
+        self.log_flush_scheduled = False
+        self.queue_polling = False
+
+        # Start the single queue polling loop
+        self.check_queue()
+
         # Check required dependencies and initialize
         self.check_dependencies()
 
@@ -421,25 +533,10 @@ class BackgroundRemoverApp:
 
     def check_dependencies(self):
         """Check if required dependencies are installed and available"""
-        dependencies_ok = True
-        missing_deps = []
-
-        # Check for rembg
-        if importlib.util.find_spec("rembg") is None:
-            dependencies_ok = False
-            missing_deps.append("rembg")
-
-        # Check for torch
-        if importlib.util.find_spec("torch") is None:
-            dependencies_ok = False
-            missing_deps.append("torch")
+        # Free when the launcher already verified the environment
+        missing_deps = missing_packages()
 
-        # Check for numpy
-        if importlib.util.find_spec("numpy") is None:
-            dependencies_ok = False
-            missing_deps.append("numpy")
-
-        if dependencies_ok:
+        if not missing_deps:
             # Initialize model in background (don't set ready state yet)
             self.init_model()
         else:
@@ -450,32 +547,12 @@ class BackgroundRemoverApp:
 
 
 
-    def remove_bg_with_model(self, input_data, session=None):
-        """Remove background using the selected model"""
-        try:
-            # Use the default rembg remove function with the selected model session
-            from rembg import remove
-            return remove(
-                input_data,
-                session=self.session,
-                only_mask=False,
-                alpha_matting=True if self.model_name == "birefnet-general" else False
-            )
-        except Exception as e:
-            self.update_status(f"Error in model processing: {str(e)}", is_error=True)
-            raise e
-
-
     def init_model(self):
         """Initialize the selected background removal model"""
         target_model = self.model_var.get()
         
-        # Check if model exists locally (rembg stores models in ~/.u2net)
-        user_home = os.path.expanduser("~")
-        model_path = os.path.join(user_home, ".u2net", f"{target_model}.onnx")
-        
-        # Only show the loading dialog if the file is MISSING
-        if not os.path.exists(model_path):
+        # Only show the loading dialog if a model file is MISSING, only that model is downloaded
+        if not all(is_downloaded(name) for name in models_for(target_model)):
             self.show_loading_dialog("Downloading Model", f"Downloading {target_model}...\n(This happens once)")
         else:
             # If exists, just update the text log and disable input briefly
@@ -484,91 +561,32 @@ class BackgroundRemoverApp:
             
         # Start thread
         threading.Thread(target=self._init_model_thread, args=(target_model,), daemon=True).start()
-        
-        # Start checking queue
-        self.check_queue()
 
     def _init_model_thread(self, model_name):
-        """Background thread for model initialization with progress capture"""
-        # Save original streams
-        original_stderr = sys.stderr
-        original_stdout = sys.stdout
-        
+        """Background thread for model initialization, download progress is reported through a callback"""
+        def report_download(name, done_bytes, total_bytes, seconds_left):
+            percent = int(done_bytes * 100 / total_bytes) if total_bytes else 0
+            if seconds_left is None:
+                time_left = "Calculating..."
+            else:
+                minutes, seconds = divmod(int(seconds_left), 60)
+                time_left = f"{minutes:02d}:{seconds:02d}"
+            self.queue.put(("download_progress", (percent, time_left)))
+
         try:
-            # Redirect BOTH streams to capture output
-            redirector = StdErrRedirector(self.queue)
-            sys.stderr = redirector
-            sys.stdout = redirector
-            
-            from rembg.session_factory import new_session
-            
-            # This triggers download (progress goes to queue)
-            self.session = new_session(model_name)
+            # Downloads a missing model first (progress goes to queue).
+            # Sessions that are already warm are reused, ones no longer needed are dropped
+            self.session_pool = SessionPool(model_name, self.session_pool, progress=report_download)
             
             # Save the successful model name
             self.model_name = model_name
-            
-            # Define remove_bg function
-            if "birefnet" in model_name:
-                self.remove_bg = self.remove_bg_with_birefnet
-            else:
-                self.remove_bg = self.remove_bg_with_model
 
             self.queue.put(("model_loaded", model_name))
             
         except Exception as e:
             self.queue.put(("model_error", str(e)))
-        finally:
-            # ALWAYS restore streams
-            sys.stderr = original_stderr
-            sys.stdout = original_stdout
 
 
-    def init_birefnet_model(self):
-        """Initialize the BiRefNet model"""
-        try:
-            # Import necessary modules from rembg
-            from rembg.session_factory import new_session
-
-            # Handle the download_models with correct parameters
-            try:
-                from rembg.bg import download_models, MODELS
-                # Pass the required models parameter
-                download_models(MODELS)
-            except (ImportError, TypeError):
-                # Alternative approach if the above fails
-                try:
-                    # Try alternative import path
-                    from rembg import download_models
-                    # Try with u2net_human_seg which is usually required for BiRefNet
-                    download_models(
-                        ["u2net", "u2net_human_seg", "u2netp", "silueta", "isnet", "isnet-general-use", "sam",
-                         "birefnet_resnet50"])
-                except Exception:
-                    # Skip download if it's not working - the model may already be downloaded
-                    self.update_status("Skipping model download - using existing models if available", is_success=True)
-
-            # Create a session with BiRefNet model
-            self.session = new_session("birefnet")
-
-            # Define remove_bg function that uses the BiRefNet model
-            self.remove_bg = self.remove_bg_with_birefnet
-
-            self.update_status("BiRefNet model initialized successfully", is_success=True)
-        except Exception as e:
-            self.update_status(f"Failed to initialize BiRefNet model: {str(e)}", is_error=True)
-            raise e
-
-    def remove_bg_with_birefnet(self, input_data, session=None):
-        """Remove background using BiRefNet model"""
-        try:
-            # Use the default rembg remove function but ensure BiRefNet model is used
-            from rembg import remove
-            return remove(input_data, session=self.session, only_mask=False, alpha_matting=True)
-        except Exception as e:
-            self.update_status(f"Error in BiRefNet processing: {str(e)}", is_error=True)
-            raise e
-
     def show_install_button(self):
         """Show the install button and disable select button"""
         self.btn_select.config(state=tk.DISABLED)
@@ -585,32 +603,22 @@ class BackgroundRemoverApp:
     def _install_dependencies_thread(self):
         """Thread for installing dependencies"""
         try:
-            # Get the Python executable path
-            python_exe = sys.executable
-
-            # Install dependencies
-            dependencies = ["torch", "numpy", "rembg", "onnxruntime"]
-
-            for dep in dependencies:
-                self.queue.put(("status", f"Installing {dep}..."))
-                process = subprocess.Popen(
-                    [python_exe, '-m', 'pip', 'install', dep],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    universal_newlines=True
-                )
-                stdout, stderr = process.communicate()
-
-                if process.returncode != 0:
-                    self.queue.put(("error", f"Failed to install {dep}: {stderr}"))
-
-            # Check if dependencies are installed
-            missing_deps = []
-            for dep in dependencies:
-                try:
-                    __import__(dep)
-                except ImportError:
-                    missing_deps.append(dep)
+            # Install the same requirements the launcher installs
+            self.queue.put(("status", "Installing requirements..."))
+            process = subprocess.Popen(
+                [sys.executable, '-m', 'pip', 'install', '-r', os.path.join(get_app_dir(), "requirements.txt")],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                universal_newlines=True
+            )
+            stdout, stderr = process.communicate()
+
+            if process.returncode != 0:
+                self.queue.put(("error", f"Failed to install requirements: {stderr}"))
+
+            # Check again and stamp the venv so the launcher won't run pip next time
+            mark_ready()
+            missing_deps = missing_packages()
 
             if missing_deps:
                 self.queue.put(("install_error", f"Failed to install: {', '.join(missing_deps)}"))
@@ -619,42 +627,324 @@ class BackgroundRemoverApp:
         except Exception as e:
             self.queue.put(("install_error", str(e)))
 
-        # Check queue for updates
-        self.root.after(100, self.check_queue)
-
     def update_status(self, message, is_error=False, is_success=False):
-        """Update status text widget with the provided message"""
-        self.status_text.config(state=tk.NORMAL)
-
+        """Queue a status message for the log widget and write it to the log file"""
         # Add timestamp
         timestamp = datetime.now().strftime("%H:%M:%S")
 
         # Set text color based on message type
         if is_error:
             tag = "error"
-            self.status_text.tag_config(tag, foreground=self.error_color)
+            self.logger.error(message)
         elif is_success:
             tag = "success"
-            self.status_text.tag_config(tag, foreground=self.success_color)
+            self.logger.info(message)
         else:
             tag = "normal"
-            self.status_text.tag_config(tag, foreground=self.text_color)
+            self.logger.info(message)
 
-        self.status_text.insert(tk.END, f"[{timestamp}] ", "timestamp")
-        self.status_text.tag_config("timestamp", foreground="#666666")
-        self.status_text.insert(tk.END, f"{message}\n", tag)
+        # The deque drops the oldest lines once more than max_log_lines are pending
+        self.pending_log.append((timestamp, message, tag))
+
+        # Worker threads must not touch Tk, the polling loop flushes their messages
+        if not self.log_flush_scheduled and threading.current_thread() is threading.main_thread():
+            self.log_flush_scheduled = True
+            self.root.after(LOG_FLUSH_INTERVAL_MS, self.flush_status_log)
+
+    def flush_status_log(self):
+        """Insert all pending log lines in one batch and trim the widget to max_log_lines"""
+        self.log_flush_scheduled = False
+        if not self.pending_log:
+            return
+
+        chunks = []
+        while self.pending_log:
+            timestamp, message, tag = self.pending_log.popleft()
+            chunks.extend((f"[{timestamp}] ", "timestamp", f"{message}\n", tag))
+
+        self.status_text.config(state=tk.NORMAL)
+        self.status_text.insert(tk.END, *chunks)
+
+        # Drop the oldest lines so the widget never grows past the cap
+        line_count = int(self.status_text.index("end-1c").split(".")[0]) - 1
+        if line_count > self.max_log_lines:
+            self.status_text.delete("1.0", f"{line_count - self.max_log_lines + 1}.0")
 
         self.status_text.see(tk.END)
         self.status_text.config(state=tk.DISABLED)
-        self.root.update_idletasks()
+
+    def set_max_log_lines(self, max_lines):
+        """Change how many lines the status log widget keeps"""
+        self.max_log_lines = max(1, int(max_lines))
+        self.pending_log = deque(self.pending_log, maxlen=self.max_log_lines)
+        self.flush_status_log()
+
+    def update_model_description(self):
+        """Show the profile of the selected model under the model picker"""
+        self.model_tooltip.config(text=describe_model(self.model_var.get()))
+
+    def show_advanced_settings(self):
+        """Show the advanced settings dialog"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Advanced Settings")
+        dialog.resizable(False, False)
+        dialog.transient(self.root)
+        dialog.configure(bg=self.bg_color)
+        dialog.grab_set()
+
+        frame = ttk.Frame(dialog, padding="15", style="TFrame")
+        frame.pack(fill=tk.BOTH, expand=True)
+
+        def add_hint(row, text):
+            ttk.Label(frame, text=text, font=('Segoe UI', 8), foreground="#666666").grid(
+                row=row, column=0, columnspan=2, sticky=tk.W, pady=(0, 10))
+
+        row = 0
+
+        # Status log line cap
+        ttk.Label(frame, text="Status log lines:").grid(row=row, column=0, sticky=tk.W, pady=5)
+        log_lines_var = tk.IntVar(value=self.max_log_lines)
+        ttk.Spinbox(frame, from_=100, to=100000, increment=100, textvariable=log_lines_var,
+                    width=10).grid(row=row, column=1, sticky=tk.W, padx=(10, 0), pady=5)
+        row += 1
+        add_hint(row, f"Full log: {LOG_FILE}")
+        row += 1
+
+        # Worker threads, 0 derives the count from the model profile
+        ttk.Label(frame, text="Workers (0 = auto):").grid(row=row, column=0, sticky=tk.W, pady=5)
+        workers_var = tk.IntVar(value=self.worker_setting)
+        ttk.Spinbox(frame, from_=0, to=64, textvariable=workers_var,
+                    width=10).grid(row=row, column=1, sticky=tk.W, padx=(10, 0), pady=5)
+        row += 1
+        auto_workers = default_workers(self.model_var.get())
+        add_hint(row, f"Auto uses {auto_workers} for {display_name(self.model_var.get())} on this machine")
+        row += 1
+
+        # Output size cap, large inputs are downscaled while they are decoded
+        ttk.Label(frame, text="Max output size (px, 0 = original):").grid(row=row, column=0, sticky=tk.W, pady=5)
+        max_size_var = tk.IntVar(value=self.max_output_size)
+        ttk.Spinbox(frame, from_=0, to=20000, increment=256, textvariable=max_size_var,
+                    width=10).grid(row=row, column=1, sticky=tk.W, padx=(10, 0), pady=5)
+        row += 1
+        add_hint(row, "Capping the size lets large JPEGs decode at a fraction of their resolution")
+        row += 1
+
+        # Post-processing before the output is encoded
+        crop_var = tk.BooleanVar(value=self.crop_to_subject)
+        ttk.Checkbutton(frame, text="Crop to subject",
+                        variable=crop_var).grid(row=row, column=0, columnspan=2, sticky=tk.W, pady=5)
+        row += 1
+        ttk.Label(frame, text="Padding (px):").grid(row=row, column=0, sticky=tk.W, pady=5)
+        padding_var = tk.IntVar(value=self.padding)
+        ttk.Spinbox(frame, from_=0, to=2000, increment=10, textvariable=padding_var,
+                    width=10).grid(row=row, column=1, sticky=tk.W, padx=(10, 0), pady=5)
+        row += 1
+        add_hint(row, "Trims the transparent border, the max output size then applies to the cropped image")
+        row += 1
+
+        # Passthrough of images without a background
+        passthrough_var = tk.BooleanVar(value=self.passthrough)
+        ttk.Checkbutton(frame, text="Keep originals that have no background to remove",
+                        variable=passthrough_var).grid(row=row, column=0, columnspan=2, sticky=tk.W, pady=5)
+        row += 1
+        add_hint(row, "Already transparent images and BGTANK outputs skip the model and are copied as they are")
+        row += 1
+
+        # ZIP output
+        zip_var = tk.BooleanVar(value=self.zip_output)
+        ttk.Checkbutton(frame, text="Write outputs into a ZIP archive",
+                        variable=zip_var).grid(row=row, column=0, columnspan=2, sticky=tk.W, pady=5)
+        row += 1
+        add_hint(row, f"Results go into {DEFAULT_OUTPUT_ARCHIVE} in the output folder instead of separate files")
+        row += 1
+
+        # Memory budget for images in flight
+        ttk.Label(frame, text="Memory budget (MB, 0 = auto):").grid(row=row, column=0, sticky=tk.W, pady=5)
+        budget_var = tk.IntVar(value=self.memory_budget_mb)
+        ttk.Spinbox(frame, from_=0, to=1024 * 1024, increment=512, textvariable=budget_var,
+                    width=10).grid(row=row, column=1, sticky=tk.W, padx=(10, 0), pady=5)
+        row += 1
+        add_hint(row, f"Auto allows {default_memory_budget(self.model_var.get())} MB on this machine, "
+                      f"large images get fewer parallel slots")
+        row += 1
+
+        # Job order
+        ttk.Label(frame, text="Job order:").grid(row=row, column=0, sticky=tk.W, pady=5)
+        order_var = tk.StringVar(value=self.job_order)
+        ttk.Combobox(frame, textvariable=order_var, values=JOB_ORDERS, state="readonly",
+                     width=14).grid(row=row, column=1, sticky=tk.W, padx=(10, 0), pady=5)
+        row += 1
+        add_hint(row, "Largest first keeps a few huge images from finishing alone at the end")
+        row += 1
+
+        # Duplicate detection
+        dedup_var = tk.BooleanVar(value=self.skip_duplicates)
+        ttk.Checkbutton(frame, text="Process identical images only once",
+                        variable=dedup_var).grid(row=row, column=0, columnspan=2, sticky=tk.W, pady=5)
+        row += 1
+        near_var = tk.BooleanVar(value=self.match_near_duplicates)
+        ttk.Checkbutton(frame, text="Also match near-duplicates (perceptual hash)",
+                        variable=near_var).grid(row=row, column=0, columnspan=2, sticky=tk.W, pady=5)
+        row += 1
+        ttk.Label(frame, text="Duplicate outputs:").grid(row=row, column=0, sticky=tk.W, pady=5)
+        fanout_var = tk.StringVar(value=self.duplicate_mode)
+        ttk.Combobox(frame, textvariable=fanout_var, values=[FANOUT_COPY, FANOUT_LINK], state="readonly",
+                     width=8).grid(row=row, column=1, sticky=tk.W, padx=(10, 0), pady=5)
+        row += 1
+        add_hint(row, "Duplicates get a copy or a hard link of the processed result")
+        row += 1
+
+        # Retries for I/O errors, broken images are never retried
+        ttk.Label(frame, text="Retries after I/O errors:").grid(row=row, column=0, sticky=tk.W, pady=5)
+        retries_var = tk.IntVar(value=self.retries)
+        ttk.Spinbox(frame, from_=0, to=10, textvariable=retries_var,
+                    width=10).grid(row=row, column=1, sticky=tk.W, padx=(10, 0), pady=5)
+        row += 1
+        add_hint(row, "Images that still fail are quarantined and can be retried after the run")
+        row += 1
+
+        # Profiling
+        profile_var = tk.BooleanVar(value=self.profile_runs)
+        ttk.Checkbutton(frame, text="Profile a sample of images",
+                        variable=profile_var).grid(row=row, column=0, columnspan=2, sticky=tk.W, pady=5)
+        row += 1
+        add_hint(row, "Writes cProfile and onnxruntime profiles next to the run report")
+        row += 1
+
+        def apply_settings():
+            try:
+                self.set_max_log_lines(log_lines_var.get())
+                self.worker_setting = max(0, int(workers_var.get()))
+                self.max_output_size = max(0, int(max_size_var.get()))
+                self.padding = max(0, int(padding_var.get()))
+                self.memory_budget_mb = max(0, int(budget_var.get()))
+                self.retries = max(0, int(retries_var.get()))
+            except (tk.TclError, ValueError):
+                self.update_status("Invalid advanced setting value", is_error=True)
+                return
+            self.skip_duplicates = dedup_var.get()
+            self.match_near_duplicates = near_var.get()
+            self.duplicate_mode = fanout_var.get()
+            self.job_order = order_var.get()
+            self.profile_runs = profile_var.get()
+            self.crop_to_subject = crop_var.get()
+            self.zip_output = zip_var.get()
+            self.passthrough = passthrough_var.get()
+            self.update_status("Advanced settings saved", is_success=True)
+            dialog.destroy()
+
+        button_row = ttk.Frame(frame, style="TFrame")
+        button_row.grid(row=row, column=0, columnspan=2, sticky=tk.E, pady=(10, 0))
+        ttk.Button(button_row, text="Cancel", command=dialog.destroy).pack(side=tk.RIGHT)
+        ttk.Button(button_row, text="Apply", command=apply_settings,
+                   style="Accent.TButton").pack(side=tk.RIGHT, padx=(0, 10))
+
+    def show_preview(self):
+        """Show before/after thumbnails of a sample of the selection, rendered in the background"""
+        if not self.file_paths:
+            messagebox.showwarning("Warning", "Please select images first!")
+            return
+
+        # Preview the selected model, loading it first when it isn't the loaded one
+        if not self.session_pool or self.session_pool.model_name != self.model_var.get():
+            if self.model_var.get() != self.model_name:
+                self.model_name = self.model_var.get()
+                self.init_model()
+            self.preview_pending = True
+            self.update_status(f"Loading {display_name(self.model_name)} for the preview...")
+            return
+
+        self.close_preview()
+        samples = sample_paths(self.file_paths)
+
+        window = tk.Toplevel(self.root)
+        window.title(f"Preview - {display_name(self.session_pool.model_name)}")
+        window.resizable(False, False)
+        window.transient(self.root)
+        window.configure(bg=self.bg_color)
+        window.protocol("WM_DELETE_WINDOW", self.close_preview)
+
+        frame = ttk.Frame(window, padding="15", style="TFrame")
+        frame.pack(fill=tk.BOTH, expand=True)
+        window.preview_frame = frame
+        window.preview_count = 0
+        window.preview_total = len(samples)
+        window.photos = []  # Tk drops images that nothing in Python refers to
+
+        window.status_label = ttk.Label(frame, text=f"Rendering {len(samples)} previews...",
+                                        font=('Segoe UI', 8), foreground="#666666")
+        window.status_label.grid(row=0, column=0, columnspan=2, sticky=tk.W, pady=(0, 10))
+
+        self.preview_window = window
+        self.preview_cancel = threading.Event()
+        threading.Thread(target=render_previews,
+                         args=(self.session_pool, self.session_pool.model_name, samples, self.queue,
+                               self.preview_cancel, self.preview_cancel),
+                         daemon=True).start()
+
+    def add_preview_result(self, result):
+        """Add one before/after pair to the preview window"""
+        window = self.preview_window
+        if not window or not window.winfo_exists():
+            return
+
+        # Two samples per row, each with the original on the left and the result on the right
+        index = window.preview_count
+        window.preview_count += 1
+        cell = ttk.Frame(window.preview_frame, style="TFrame")
+        cell.grid(row=1 + index // 2, column=index % 2, padx=5, pady=5, sticky=tk.NW)
+
+        name = os.path.basename(result.path)
+        if result.error:
+            ttk.Label(cell, text=f"{name}: {result.error}", foreground=self.error_color,
+                      wraplength=330).pack(anchor=tk.W)
+        else:
+            images = ttk.Frame(cell, style="TFrame")
+            images.pack(anchor=tk.W)
+            for thumbnail in (result.before, result.after):
+                photo = ImageTk.PhotoImage(thumbnail)
+                window.photos.append(photo)
+                ttk.Label(images, image=photo).pack(side=tk.LEFT, padx=(0, 5))
+            ttk.Label(cell, text=f"{name} · {display_name(result.model)} · {result.seconds:.1f}s",
+                      font=('Segoe UI', 8)).pack(anchor=tk.W)
+
+        if window.preview_count < window.preview_total:
+            window.status_label.config(text=f"Rendered {window.preview_count} of {window.preview_total}...")
+        else:
+            window.status_label.config(text="Original on the left, result on the right. Samples are "
+                                            "processed at reduced size.")
+
+    def close_preview(self):
+        """Close the preview window and stop its background thread"""
+        if self.preview_cancel:
+            self.preview_cancel.set()
+            self.preview_cancel = None
+        if self.preview_window and self.preview_window.winfo_exists():
+            self.preview_window.destroy()
+        self.preview_window = None
 
     def select_images(self):
-        """Open dialog to select images"""
-        self.file_paths = filedialog.askopenfilenames(
+        """Open dialog to select images, archives are expanded into the images they contain"""
+        selected = filedialog.askopenfilenames(
             title="Select Images",
-            filetypes=[("Image files", "*.png *.jpg *.jpeg *.bmp *.webp")]
+            filetypes=[("Image files", "*.png *.jpg *.jpeg *.bmp *.webp"),
+                       ("Archives", "*.zip *.tar *.tar.gz *.tgz *.tar.bz2 *.tbz2 *.tar.xz *.txz")]
         )
 
+        self.file_paths = []
+        for path in selected:
+            if not is_archive(path):
+                self.file_paths.append(path)
+                continue
+            try:
+                # Members are read straight from the archive later, nothing is extracted
+                members = archive_images(path)
+            except Exception as e:
+                self.update_status(f"Could not read {os.path.basename(path)}: {str(e)}", is_error=True)
+                continue
+            self.update_status(f"{len(members)} images in {os.path.basename(path)}")
+            self.file_paths.extend(members)
+
         if not self.file_paths:
             self.update_status("No images selected.")
             return
@@ -669,6 +959,8 @@ class BackgroundRemoverApp:
         else:
             self.update_status(f"First few files: {', '.join([os.path.basename(p) for p in self.file_paths[:3]])}...")
 
+        self.btn_preview.config(state=tk.NORMAL)
+
         # Enable process button if output directory is set
         if self.output_dir:
             self.btn_process.config(state=tk.NORMAL)
@@ -756,8 +1048,8 @@ class BackgroundRemoverApp:
         except Exception as e:
             self.update_status(f"Failed to open output folder: {str(e)}", is_error=True)
 
-    def start_processing(self):
-        """Start the background removal process"""
+    def start_processing(self, resume=False):
+        """Start the background removal process, resume continues the job in the output folder"""
         if not self.file_paths:
             messagebox.showwarning("Warning", "Please select images first!")
             return
@@ -790,19 +1082,57 @@ class BackgroundRemoverApp:
                 return
 
         # Check if model is loaded properly
-        if not hasattr(self, 'remove_bg') or not self.session:
+        if not self.session_pool or self.session_pool.model_name != self.model_name:
             self.update_status("Model is not functioning properly. Please try reinstalling.", is_error=True)
             self.show_install_button()
             return
 
+        # Open the job store, an unfinished job in this output directory can be resumed
+        try:
+            self.job_store = JobStore(job_store_path(self.output_dir))
+            self.job_store.recover()
+            if self.zip_output:
+                missing = requeue_missing_outputs(self.job_store, os.path.join(self.output_dir, DEFAULT_OUTPUT_ARCHIVE),
+                                                  self.suffix)
+                if missing:
+                    self.update_status(f"{missing} done images are missing from {DEFAULT_OUTPUT_ARCHIVE} "
+                                       f"and are queued again")
+            waiting = self.job_store.counts()[PENDING]
+            if resume:
+                self.update_status(f"Retrying {waiting} images")
+            elif waiting and messagebox.askyesno(
+                    "Resume Job",
+                    f"{waiting} images of an unfinished job are waiting in this output folder.\n\n"
+                    f"Resume that job instead of starting a new one?"):
+                self.update_status(f"Resuming unfinished job with {waiting} images left")
+            else:
+                self.job_store.reset()
+                self.job_store.add(self.file_paths)
+        except (OSError, sqlite3.Error) as e:
+            messagebox.showerror("Error", f"Could not open the job store:\n{str(e)}")
+            return
+
+        # Open the run report in the output directory
+        try:
+            self.report = RunReport(report_path_for(self.output_dir))
+        except OSError as e:
+            self.job_store.close()
+            self.job_store = None
+            messagebox.showerror("Error", f"Could not create run report:\n{str(e)}")
+            return
+
         # Reset progress bar
         self.progress["value"] = 0
-        self.progress["maximum"] = len(self.file_paths)
+        self.progress["maximum"] = sum(self.job_store.counts().values())
         self.progress_percentage.config(text="0%")
 
         # Reset counter
         self.processed_count = 0
 
+        # Derive the worker pool from the model profile unless it was set by hand
+        self.workers = self.worker_setting or default_workers(self.model_name)
+        self.batch_size = default_batch_size(self.model_name)
+
         # Disable buttons during processing
         self.btn_select.config(state=tk.DISABLED)
         self.btn_process.config(state=tk.DISABLED)
@@ -810,39 +1140,56 @@ class BackgroundRemoverApp:
         self.btn_browse_output.config(state=tk.DISABLED)
         self.suffix_entry.config(state=tk.DISABLED)
         self.output_dir_entry.config(state=tk.DISABLED)
-        self.rb_birefnet.config(state=tk.DISABLED)
-        self.rb_u2net.config(state=tk.DISABLED)
+        self.model_combo.config(state=tk.DISABLED)
 
         # Record start time
         self.start_time = datetime.now()
 
         # Update status
-        model_name_display = "BiRefNet" if self.model_name == "birefnet-general" else "U2Net"
+        model_name_display = display_name(self.model_name)
 
         self.update_status(
             f"Starting background removal with {model_name_display} for {len(self.file_paths)} images...",
             is_success=True)
         self.update_status(f"Output directory: {self.output_dir}")
+        self.update_status(f"Workers: {self.workers}, queued per worker: {self.batch_size}")
+        self.update_status(f"Run report: {self.report.path}")
 
         # Start processing thread
         self.is_processing = True
-        threading.Thread(target=self.process_images, daemon=True).start()
-
-        # Start checking queue for updates
-        self.root.after(100, self.check_queue)
+        self.engine = BatchEngine(
+            self.session_pool, self.model_name, self.output_dir, self.suffix, self.queue, self.report,
+            workers=self.workers,
+            batch_size=self.batch_size,
+            skip_duplicates=self.skip_duplicates,
+            match_near_duplicates=self.match_near_duplicates,
+            duplicate_mode=self.duplicate_mode,
+            max_output_size=self.max_output_size,
+            memory_budget_mb=self.memory_budget_mb,
+            job_order=self.job_order,
+            store=self.job_store,
+            retries=self.retries,
+            profiler=RunProfiler(self.report.path) if self.profile_runs else None,
+            crop_to_subject=self.crop_to_subject,
+            padding=self.padding,
+            output_archive=os.path.join(self.output_dir, DEFAULT_OUTPUT_ARCHIVE) if self.zip_output else None,
+            passthrough=self.passthrough
+        )
+        threading.Thread(target=self.engine.run, daemon=True).start()
 
     def update_time_estimate(self):
-        """Update the estimated time remaining"""
-        if self.start_time and self.processed_count > 0:
-            elapsed = (datetime.now() - self.start_time).total_seconds()
-            images_left = len(self.file_paths) - self.processed_count
-
-            # Calculate time per image
-            time_per_image = elapsed / self.processed_count
+        """Update the live rate, the stage breakdown and the estimated time remaining"""
+        if not self.engine:
+            return
+        stats = self.engine.throughput.snapshot()
 
-            # Estimate remaining time
-            remaining_seconds = time_per_image * images_left
+        stages = stats["stage_seconds"]
+        if stages:
+            self.stage_label.config(text=" • ".join(f"{stage} {seconds:.2f}s" for stage, seconds in stages.items()))
 
+        # The rate is known after the first second of completions
+        remaining_seconds = stats["remaining_seconds"]
+        if remaining_seconds is not None:
             # Format the remaining time
             if remaining_seconds < 60:
                 time_str = f"~{int(remaining_seconds)}s remaining"
@@ -853,52 +1200,23 @@ class BackgroundRemoverApp:
                 minutes = int((remaining_seconds % 3600) / 60)
                 time_str = f"~{hours}h {minutes}m remaining"
 
-            self.time_label.config(text=time_str)
-
-    def process_images(self):
-        """Process images in a separate thread"""
-        try:
-            for i, input_path in enumerate(self.file_paths):
-                try:
-                    # Update status via queue
-                    self.queue.put(("status", f"Processing with BiRefNet: {os.path.basename(input_path)}"))
-
-                    # Open image and remove background
-                    with open(input_path, 'rb') as i_file:
-                        input_data = i_file.read()
-                        output_data = self.remove_bg(input_data, session=self.session)
-
-                    # Save the result
-                    filename = os.path.basename(input_path)
-                    filename_no_ext = os.path.splitext(filename)[0]
-                    output_path = os.path.join(self.output_dir, f"{filename_no_ext}{self.suffix}.png")
-
-                    with open(output_path, 'wb') as o_file:
-                        o_file.write(output_data)
-
-                    # Update progress via queue
-                    self.processed_count = i + 1
-                    self.queue.put(("progress", self.processed_count))
-                    self.queue.put(
-                        ("success", f"Completed: {os.path.basename(input_path)} -> {os.path.basename(output_path)}"))
-
-                    # Update time estimate
-                    self.queue.put(("update_time", None))
-
-                except Exception as e:
-                    self.queue.put(("error", f"Error ({os.path.basename(input_path)}): {str(e)}"))
-
-            # All done
-            self.queue.put(("completed", None))
-
-        except Exception as e:
-            self.queue.put(("fatal_error", str(e)))
+            rate_str = f"{stats['images_per_second']:.2f} img/s • {stats['megapixels_per_second']:.1f} MP/s"
+            self.time_label.config(text=f"{rate_str} • {time_str}")
 
     def check_queue(self):
         """Check for updates from the processing threads"""
+        # Only one polling loop may run, extra calls are ignored
+        if self.queue_polling:
+            return
+        self.queue_polling = True
+        self.poll_queue()
+
+    def poll_queue(self):
+        """Drain queued messages for a bounded time slice, then reschedule"""
+        deadline = time.monotonic() + QUEUE_TIME_BUDGET
         try:
-            # Process up to 5 messages at a time to keep UI responsive
-            for _ in range(5):
+            # Keep draining until the time budget is used up to keep the UI responsive
+            while time.monotonic() < deadline:
                 message_type, message = self.queue.get_nowait()
 
                 if message_type == "status":
@@ -933,22 +1251,38 @@ class BackgroundRemoverApp:
                     self.btn_select.config(state=tk.NORMAL)
                     self.btn_install.pack_forget()
 
+                    if self.preview_pending:
+                        self.preview_pending = False
+                        self.show_preview()
+
                 elif message_type == "model_error":
+                    self.preview_pending = False
                     self.close_loading_dialog()
                     self.update_status(f"Error initializing model: {message}", is_error=True)
                     self.show_install_button()
-                    # Revert radio button
+                    # Revert model selection
                     self.model_var.set(self.model_name)
+                    self.update_model_description()
 
                 elif message_type == "success":
                     self.update_status(message, is_success=True)
                 elif message_type == "error":
                     self.update_status(message, is_error=True)
                 elif message_type == "progress":
-                    self.progress["value"] = message
-                    percentage = int((message / len(self.file_paths)) * 100)
-                    self.progress_percentage.config(text=f"{percentage}%")
-                    self.counter_label.config(text=f"Processing: {message}/{len(self.file_paths)}")
+                    self.processed_count = message
+                    if self.job_store:
+                        # Progress comes from the job store so resumed jobs count what was done before
+                        counts = self.job_store.counts()
+                        finished = counts[DONE] + counts[FAILED]
+                        total = max(1, sum(counts.values()))
+                        self.progress["value"] = finished
+                        self.progress_percentage.config(text=f"{int(finished / total * 100)}%")
+                        self.counter_label.config(text=f"Processing: {finished}/{total}")
+                elif message_type == "preview":
+                    token, result = message
+                    # Results of a preview that was closed or replaced are dropped
+                    if token is self.preview_cancel:
+                        self.add_preview_result(result)
                 elif message_type == "update_time":
                     self.update_time_estimate()
                 elif message_type == "fatal_error":
@@ -961,12 +1295,22 @@ class BackgroundRemoverApp:
                     time_str = f"{int(minutes)}m {int(seconds)}s" if minutes > 0 else f"{int(seconds)}s"
 
                     self.update_status(f"All tasks completed in {time_str}!", is_success=True)
-                    result = messagebox.askquestion("Success",
-                                                    f"All processing completed.\nOutput saved to: {self.output_dir}\n\nWould you like to open the output folder?")
-                    self.finish_processing()
 
-                    if result == "yes":
-                        self.open_output_folder()
+                    # Quarantined images can go straight into another pass
+                    failed = self.job_store.counts()[FAILED] if self.job_store else 0
+                    if failed and messagebox.askyesno(
+                            "Some Images Failed",
+                            f"{failed} images failed and were quarantined.\n\nRetry them now?"):
+                        self.job_store.requeue_failed()
+                        self.finish_processing()
+                        self.start_processing(resume=True)
+                    else:
+                        result = messagebox.askquestion("Success",
+                                                        f"All processing completed.\nOutput saved to: {self.output_dir}\n\nWould you like to open the output folder?")
+                        self.finish_processing()
+
+                        if result == "yes":
+                            self.open_output_folder()
                 elif message_type == "install_success":
                     self.update_status("Dependencies installed successfully!", is_success=True)
                     self.btn_install.config(text="Install Dependencies")
@@ -979,9 +1323,12 @@ class BackgroundRemoverApp:
 
         except queue.Empty:
             pass
-        
+
+        # Insert everything logged during this slice in one batch
+        self.flush_status_log()
+
         # ALWAYS check again after 100ms (This keeps the loop alive)
-        self.root.after(100, self.check_queue)
+        self.root.after(QUEUE_POLL_INTERVAL_MS, self.poll_queue)
 
     def finish_processing(self):
         """Reset the UI after processing is complete"""
@@ -992,100 +1339,42 @@ class BackgroundRemoverApp:
         self.btn_browse_output.config(state=tk.NORMAL)
         self.suffix_entry.config(state=tk.NORMAL)
         self.output_dir_entry.config(state=tk.NORMAL)
-        self.rb_birefnet.config(state=tk.NORMAL)
-        self.rb_u2net.config(state=tk.NORMAL)
+        self.model_combo.config(state="readonly")
         self.counter_label.config(text="Ready")
         self.time_label.config(text="")
+        self.stage_label.config(text="")
+
+        if self.job_store:
+            self.job_store.close()
+            self.job_store = None
 
         # Get model name for display
-        model_name_display = "BiRefNet" if self.model_name == "birefnet-general" else "U2Net"
+        model_name_display = display_name(self.model_name)
         self.update_status(f"Process completed with {model_name_display} model.")
 
 
 if __name__ == "__main__":
-    # Check and install required dependencies before launching the app
-    import sys
-    import subprocess
-    import importlib.util
-    import tkinter as tk
-    from tkinter import messagebox
-
-
-    def check_and_install_dependencies():
-        required_packages = ["torch", "numpy", "rembg", "onnxruntime", "Pillow"]
-        missing_packages = []
-
-        # Check which packages are missing
-        for package in required_packages:
-            if importlib.util.find_spec(package) is None:
-                # Special case for Pillow which is imported as PIL
-                if package == "Pillow" and importlib.util.find_spec("PIL") is not None:
-                    continue
-                missing_packages.append(package)
-
-        # If packages are missing, install them
-        if missing_packages:
-            print(f"Installing missing dependencies: {', '.join(missing_packages)}")
-            try:
-                # Create a simple splash window to show installation progress
-                splash = tk.Tk()
-                splash.title("Installing Dependencies")
-                splash.geometry("400x150")
-                splash.resizable(False, False)
-
-                # Center the window
-                splash.update_idletasks()
-                width = splash.winfo_width()
-                height = splash.winfo_height()
-                x = (splash.winfo_screenwidth() // 2) - (width // 2)
-                y = (splash.winfo_screenheight() // 2) - (height // 2)
-                splash.geometry(f'{width}x{height}+{x}+{y}')
-
-                label = tk.Label(splash,
-                                 text=f"Installing required dependencies...\n{', '.join(missing_packages)}\n\nPlease wait, this might take a few minutes.",
-                                 pady=20, padx=20)
-                label.pack()
-
-                progress = tk.Label(splash, text="")
-                progress.pack()
-
-                splash.update()
-
-                # Install each missing package
-                for i, package in enumerate(missing_packages):
-                    progress.config(text=f"Installing {package}... ({i + 1}/{len(missing_packages)})")
-                    splash.update()
-                    subprocess.check_call([sys.executable, "-m", "pip", "install", package])
-
-                # Close splash window after installation
-                splash.destroy()
-                return True
-
-            except Exception as e:
-                messagebox.showerror("Installation Error",
-                                     f"Failed to install dependencies: {str(e)}\n\n"
-                                     f"Please manually install the following packages:\n"
-                                     f"{', '.join(missing_packages)}\n\n"
-                                     f"Run these commands in your terminal:\n"
-                                     f"pip install {' '.join(missing_packages)}")
-                return False
-
-        return True
-
-
-    # Run dependency check and installation
-    if check_and_install_dependencies():
-        # Create the main window
-        root = tk.Tk()
-        app = BackgroundRemoverApp(root)
-
-        # Center window on screen
-        root.update_idletasks()
-        width = root.winfo_width()
-        height = root.winfo_height()
-        x = (root.winfo_screenwidth() // 2) - (width // 2)
-        y = (root.winfo_screenheight() // 2) - (height // 2)
-        root.geometry(f'{width}x{height}+{x}+{y}')
-
-        # Start the main loop
-        root.mainloop()
\ No newline at end of file
+    root = tk.Tk()
+    if IMPORT_ERROR is not None:
+        # Counts as the window being up, BGTANK.py shouldn't wait out its timeout
+        signal_ready()
+        installed = install_missing_packages(root, IMPORT_ERROR)
+        root.destroy()
+        sys.exit(0 if installed else 1)
+
+    # Packages that import but are incomplete are reported inside the app by check_dependencies
+    app = BackgroundRemoverApp(root)
+
+    # Center window on screen
+    root.update_idletasks()
+    width = root.winfo_width()
+    height = root.winfo_height()
+    x = (root.winfo_screenwidth() // 2) - (width // 2)
+    y = (root.winfo_screenheight() // 2) - (height // 2)
+    root.geometry(f'{width}x{height}+{x}+{y}')
+
+    # Let BGTANK.py know the window is up once the first frame is drawn
+    root.after_idle(signal_ready)
+
+    # Start the main loop
+    root.mainloop()
\ No newline at end of file
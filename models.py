@@ -0,0 +1,230 @@
+"""
+models.py - Model registry and selection helpers for BGTANK
+
+Every rembg model BGTANK offers has a resource profile here. Worker counts and
+batch sizes are derived from those profiles. Auto mode keeps a fast and an
+accurate model warm and routes every image to one of them with a cheap
+background-uniformity check on a tiny thumbnail.
+"""
+
+import ctypes
+import os
+import sys
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+# input_size: edge of the square the model runs at
+# memory_mb: approximate resident memory of one loaded session while it runs
+# throughput: reference images/sec for one session on an 8-core desktop CPU, without matting
+# alpha_matting: whether alpha matting is recommended for the model's masks
+ModelProfile = namedtuple(
+    "ModelProfile",
+    ["name", "label", "input_size", "memory_mb", "throughput", "alpha_matting", "description"]
+)
+
+MODEL_PROFILES = {
+    profile.name: profile for profile in [
+        ModelProfile("birefnet-general", "BiRefNet", 1024, 3000, 0.3, True,
+                     "High accuracy with the best edges, slowest"),
+        ModelProfile("birefnet-general-lite", "BiRefNet Lite", 1024, 1200, 0.8, True,
+                     "Lighter BiRefNet, good edges at about twice the speed"),
+        ModelProfile("birefnet-portrait", "BiRefNet Portrait", 1024, 3000, 0.3, True,
+                     "BiRefNet tuned for people and hair"),
+        ModelProfile("birefnet-dis", "BiRefNet DIS", 1024, 3000, 0.3, True,
+                     "BiRefNet for fine, highly detailed objects"),
+        ModelProfile("birefnet-hrsod", "BiRefNet HRSOD", 1024, 3000, 0.3, True,
+                     "BiRefNet for high resolution salient objects"),
+        ModelProfile("birefnet-cod", "BiRefNet COD", 1024, 3000, 0.3, True,
+                     "BiRefNet for camouflaged objects"),
+        ModelProfile("birefnet-massive", "BiRefNet Massive", 1024, 3000, 0.3, True,
+                     "BiRefNet trained on the largest dataset"),
+        ModelProfile("bria-rmbg", "BRIA RMBG", 1024, 1000, 1.0, False,
+                     "BRIA RMBG 2.0, accurate general purpose model"),
+        ModelProfile("isnet-general-use", "ISNet", 1024, 900, 1.5, False,
+                     "Good general purpose accuracy, moderate speed"),
+        ModelProfile("isnet-anime", "ISNet Anime", 1024, 900, 1.5, False,
+                     "ISNet for anime and illustrations"),
+        ModelProfile("u2net", "U2Net", 320, 600, 4.0, False,
+                     "Fast, good results for simple backgrounds"),
+        ModelProfile("u2net_human_seg", "U2Net Human", 320, 600, 4.0, False,
+                     "U2Net for people"),
+        ModelProfile("silueta", "Silueta", 320, 200, 10.0, False,
+                     "Compact U2Net, very fast on easy images"),
+        ModelProfile("u2netp", "U2Net Lite", 320, 80, 20.0, False,
+                     "Tiny U2Net, fastest, for clean studio shots"),
+    ]
+}
+
+AUTO_MODEL = "auto"
+FAST_MODEL = "u2net"
+QUALITY_MODEL = "birefnet-general"
+DEFAULT_MODEL = QUALITY_MODEL
+
+# Worker defaults
+MEMORY_FRACTION = 0.6  # Share of physical RAM the workers may plan to use
+FALLBACK_MEMORY_MB = 8192  # Used when the RAM size cannot be read
+MAX_BATCH_SIZE = 16  # Images queued ahead per worker
+
+# Background-uniformity check settings
+ROUTING_SAMPLE_SIZE = 64  # Thumbnail edge used for the check
+ROUTING_BORDER = 4  # Border width in thumbnail pixels
+ROUTING_TOLERANCE = 12  # Max per-channel step between neighbouring border pixels
+ROUTING_MIN_UNIFORM = 0.92  # Fraction of border pixels that must be smooth
+
+
+def get_profile(model_name):
+    """Get the resource profile of a model, unknown models are treated like the default"""
+    return MODEL_PROFILES.get(model_name, MODEL_PROFILES[DEFAULT_MODEL])
+
+
+def display_name(model_name):
+    """Get a short human readable name for a model"""
+    if model_name == AUTO_MODEL:
+        return "Auto"
+    if model_name in MODEL_PROFILES:
+        return MODEL_PROFILES[model_name].label
+    return model_name
+
+
+def describe_model(model_name):
+    """One line summary of a model setting for the settings frame"""
+    if model_name == AUTO_MODEL:
+        return (f"Auto: {display_name(FAST_MODEL)} for plain studio backgrounds, "
+                f"{display_name(QUALITY_MODEL)} for everything else (both stay loaded).")
+    profile = get_profile(model_name)
+    matting = ", alpha matting" if profile.alpha_matting else ""
+    return (f"{profile.label}: {profile.description}. {profile.input_size}px input, "
+            f"~{profile.memory_mb} MB, ~{profile.throughput:g} img/s{matting}.")
+
+
+def total_memory_mb():
+    """Get the physical memory of this machine in MB"""
+    try:
+        if sys.platform == "win32":
+            class MemoryStatus(ctypes.Structure):
+                _fields_ = [
+                    ("dwLength", ctypes.c_ulong),
+                    ("dwMemoryLoad", ctypes.c_ulong),
+                    ("ullTotalPhys", ctypes.c_ulonglong),
+                    ("ullAvailPhys", ctypes.c_ulonglong),
+                    ("ullTotalPageFile", ctypes.c_ulonglong),
+                    ("ullAvailPageFile", ctypes.c_ulonglong),
+                    ("ullTotalVirtual", ctypes.c_ulonglong),
+                    ("ullAvailVirtual", ctypes.c_ulonglong),
+                    ("ullAvailExtendedVirtual", ctypes.c_ulonglong),
+                ]
+
+            status = MemoryStatus()
+            status.dwLength = ctypes.sizeof(MemoryStatus)
+            if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+                return status.ullTotalPhys // (1024 * 1024)
+            return FALLBACK_MEMORY_MB
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (AttributeError, OSError, ValueError):
+        return FALLBACK_MEMORY_MB
+
+
+def default_workers(model_name, cpu_count=None, memory_mb=None):
+    """Number of worker threads for a model, limited by CPU cores and by RAM"""
+    profiles = [get_profile(name) for name in models_for(model_name)]
+    cpu_count = cpu_count or os.cpu_count() or 1
+    memory_mb = memory_mb or total_memory_mb()
+
+    # Large-input models already keep several cores busy per inference
+    threads_per_worker = 4 if max(p.input_size for p in profiles) >= 1024 else 2
+    by_cpu = max(1, cpu_count // threads_per_worker)
+
+    # Each concurrent inference needs roughly one more footprint of activations
+    footprint = max(p.memory_mb for p in profiles)
+    loaded = sum(p.memory_mb for p in profiles)
+    by_memory = max(1, int((memory_mb * MEMORY_FRACTION - loaded) // footprint))
+
+    return min(by_cpu, by_memory)
+
+
+def default_batch_size(model_name):
+    """Number of images queued ahead per worker, fast models get longer queues"""
+    throughput = min(get_profile(name).throughput for name in models_for(model_name))
+    return max(1, min(MAX_BATCH_SIZE, int(round(throughput))))
+
+
+def models_for(model_name):
+    """List the models that must be loaded for the selected model setting"""
+    if model_name == AUTO_MODEL:
+        return [FAST_MODEL, QUALITY_MODEL]
+    return [model_name]
+
+
+def create_session(model_name, intra_op_threads=0, profile_prefix=None, progress=None, providers=None):
+    """Create a rembg session the way rembg's new_session does, with our own thread settings
+
+    intra_op_threads splits the cores between sessions that run side by side,
+    0 lets onnxruntime use every core. With profile_prefix onnxruntime records
+    every kernel the session runs into a JSON trace starting with that path.
+    A missing model file is downloaded first, reporting through progress (see
+    modelstore.download_model). Without providers, the fastest execution
+    providers measured on this machine are used (see providers.py).
+    """
+    import onnxruntime as ort
+
+    from modelstore import download_model, is_downloaded, session_class, verified_load
+    from providers import CPU_PROVIDER, choose_providers
+
+    cls = session_class(model_name)
+
+    if not is_downloaded(model_name):
+        try:
+            download_model(model_name, progress)
+        except OSError:
+            # rembg downloads the file itself then, just without progress reports
+            pass
+
+    options = ort.SessionOptions()
+    if intra_op_threads:
+        options.intra_op_num_threads = intra_op_threads
+    if profile_prefix:
+        options.enable_profiling = True
+        options.profile_file_prefix = profile_prefix
+    if providers is None:
+        providers = choose_providers(model_name)
+
+    # Skips rembg's full-file checksum while the model file is unchanged since it was verified
+    with verified_load(model_name):
+        try:
+            return cls(model_name, options, providers=providers)
+        except Exception:
+            if providers == [CPU_PROVIDER]:
+                raise
+            # An optional provider that breaks on this model never stops the app, the CPU always works
+            return cls(model_name, options, providers=[CPU_PROVIDER])
+
+
+def background_uniformity(image):
+    """Return the fraction of border pixels that sit on a smooth backdrop
+
+    Meant for the image that was decoded for processing anyway, only a grid
+    of its pixels is read.
+    """
+    # Nearest sampling keeps texture that averaging would smooth into a flat color, and only
+    # the sampled pixels are converted
+    thumb = image.resize((ROUTING_SAMPLE_SIZE, ROUTING_SAMPLE_SIZE), Image.NEAREST).convert("RGB")
+    pixels = np.asarray(thumb, dtype=np.int16)
+
+    # Largest step to the right or lower neighbour, so plain sweeps and gradients still count as smooth
+    step = np.zeros(pixels.shape[:2], dtype=np.int16)
+    step[:, :-1] = np.abs(np.diff(pixels, axis=1)).max(axis=2)
+    step[:-1, :] = np.maximum(step[:-1, :], np.abs(np.diff(pixels, axis=0)).max(axis=2))
+
+    b = ROUTING_BORDER
+    border = np.ones(step.shape, dtype=bool)
+    border[b:-b, b:-b] = False
+    return float(np.mean(step[border] <= ROUTING_TOLERANCE))
+
+
+def choose_model(image):
+    """Route an image to the fast model when its background is a plain studio backdrop"""
+    if background_uniformity(image) >= ROUTING_MIN_UNIFORM:
+        return FAST_MODEL
+    return QUALITY_MODEL
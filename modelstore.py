@@ -0,0 +1,230 @@
+"""
+modelstore.py - Index of the downloaded model files for BGTANK
+
+rembg verifies the MD5 of a model file every time a session is created, which
+reads the whole file (about 1 GB for BiRefNet) on each model switch and
+startup. The index remembers each file's size and mtime once rembg has
+verified it. While a file is unchanged, sessions are created with rembg's
+checksum turned off, so loading a model costs a stat call. A changed or new
+file is verified again and only that one model is downloaded when it is
+missing.
+
+Missing models are downloaded here rather than by rembg, so download progress
+is reported through a callback instead of being scraped from the console.
+Where a model file lives is asked from rembg's session class, since rembg has
+moved its model directory between versions.
+"""
+
+import json
+import os
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from datetime import datetime
+
+INDEX_NAME = "bgtank_models.json"
+CHECKSUM_ENV_VAR = "MODEL_CHECKSUM_DISABLED"  # Read by rembg when it creates a session
+
+RELEASE_URL = "https://github.com/danielgatis/rembg/releases/download/v0.0.0/"
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_TIMEOUT = 30  # Seconds without data before a download fails
+PROGRESS_INTERVAL = 0.1  # Seconds between progress callbacks
+
+# Release file names that differ from the model name, the others are <model>.onnx
+MODEL_FILES = {
+    "birefnet-general": "BiRefNet-general-epoch_244.onnx",
+    "birefnet-general-lite": "BiRefNet-general-bb_swin_v1_tiny-epoch_232.onnx",
+    "birefnet-portrait": "BiRefNet-portrait-epoch_150.onnx",
+    "birefnet-dis": "BiRefNet-DIS-epoch_590.onnx",
+    "birefnet-hrsod": "BiRefNet-HRSOD_DHU-epoch_115.onnx",
+    "birefnet-cod": "BiRefNet-COD-epoch_125.onnx",
+    "birefnet-massive": "BiRefNet-massive-TR_DIS5K_TR_TEs-epoch_420.onnx",
+    "bria-rmbg": "bria-rmbg-2.0.onnx",
+}
+
+# The checksum switch is one environment variable for the whole process. Loads of
+# verified files share it turned off and run side by side, a load that needs
+# rembg's checksum waits until it can run with the switch on, alone
+_switch = threading.Condition()
+_unchecked_loads = 0
+_checked_load = False
+
+
+def session_class(model_name):
+    """rembg's session class of a model"""
+    from rembg.sessions import sessions_class
+
+    cls = next((cls for cls in sessions_class if cls.name() == model_name), None)
+    if cls is None:
+        raise ValueError(f"Unknown model: {model_name}")
+    return cls
+
+
+def model_home():
+    """Directory rembg keeps its data in, the model index is stored there too"""
+    from rembg.sessions.base import BaseSession
+
+    # rembg_home replaced u2net_home, which older versions only have
+    return getattr(BaseSession, "rembg_home", BaseSession.u2net_home)()
+
+
+def model_path(model_name):
+    """Path of a model file, or where rembg looks for it first while it isn't downloaded
+
+    Current rembg keeps each model in <home>/models/<name>/ and still reads
+    files from the old flat ~/.u2net directory, older versions only use the
+    flat directory.
+    """
+    filename = f"{model_name}.onnx"
+    cls = session_class(model_name)
+    if hasattr(cls, "resolve_existing"):
+        return cls.resolve_existing(filename) or os.path.join(cls.model_dir(), filename)
+    return os.path.join(cls.u2net_home(), filename)
+
+
+def is_downloaded(model_name):
+    return os.path.isfile(model_path(model_name))
+
+
+def download_model(model_name, progress=None):
+    """Download one model file into the model directory
+
+    progress is called as progress(model_name, done_bytes, total_bytes,
+    seconds_left) while the file downloads. total_bytes is 0 and seconds_left
+    None while they are unknown.
+    """
+    url = RELEASE_URL + MODEL_FILES.get(model_name, f"{model_name}.onnx")
+    path = model_path(model_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Download next to the target and move it in place once complete
+    part_path = f"{path}.part"
+    try:
+        with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT) as response, open(part_path, "wb") as f:
+            total = int(response.headers.get("Content-Length") or 0)
+            done = 0
+            start = last_report = time.monotonic()
+            for chunk in iter(lambda: response.read(DOWNLOAD_CHUNK_SIZE), b""):
+                f.write(chunk)
+                done += len(chunk)
+
+                now = time.monotonic()
+                if progress and (now - last_report >= PROGRESS_INTERVAL or done == total):
+                    last_report = now
+                    rate = done / max(now - start, 1e-6)
+                    seconds_left = (total - done) / rate if total and done else None
+                    progress(model_name, done, total, seconds_left)
+
+        # A dropped connection can end the response early without an error
+        if total and done != total:
+            raise OSError(f"Download of {model_name} ended after {done} of {total} bytes")
+        os.replace(part_path, path)
+    except BaseException:
+        try:
+            os.remove(part_path)
+        except OSError:
+            pass
+        raise
+    return path
+
+
+def load_index():
+    try:
+        with open(os.path.join(model_home(), INDEX_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_index(index):
+    """Write the index atomically so a crash never leaves it half written"""
+    path = os.path.join(model_home(), INDEX_NAME)
+    tmp_path = f"{path}.tmp"
+    try:
+        os.makedirs(model_home(), exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+
+def file_signature(path):
+    """Size and modification time, None if the file is missing"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def is_verified(model_name, index=None):
+    """Check whether the model file is unchanged since it was last verified"""
+    entry = (index if index is not None else load_index()).get(model_name)
+    signature = file_signature(model_path(model_name))
+    return bool(entry and signature and [entry["size"], entry["mtime_ns"]] == list(signature))
+
+
+def record_verified(model_name):
+    """Remember the current model file as verified"""
+    path = model_path(model_name)
+    signature = file_signature(path)
+    if signature is None:
+        return
+    index = load_index()
+    index[model_name] = {
+        "size": signature[0],
+        "mtime_ns": signature[1],
+        "verified": datetime.now().isoformat(timespec="seconds"),
+    }
+    save_index(index)
+
+
+@contextmanager
+def verified_load(model_name):
+    """Create a session inside this block, rembg skips its checksum when the file is known good
+
+    Only switching the checksum is guarded, the sessions themselves are built
+    in parallel.
+    """
+    global _unchecked_loads, _checked_load
+
+    with _switch:
+        while True:
+            # Set by the user, nothing is ever checked then
+            if not _unchecked_loads and os.environ.get(CHECKSUM_ENV_VAR) is not None:
+                verified = None
+                break
+            if _checked_load:
+                _switch.wait()
+                continue
+            verified = is_verified(model_name)
+            if verified:
+                _unchecked_loads += 1
+                os.environ[CHECKSUM_ENV_VAR] = "1"
+                break
+            if not _unchecked_loads:
+                _checked_load = True
+                break
+            _switch.wait()
+
+    if verified is None:
+        yield
+        return
+
+    try:
+        yield
+        # rembg checked (or downloaded) the file, so it is good from now on.
+        # Recorded before the waiting loads look at the index again
+        if not verified:
+            record_verified(model_name)
+    finally:
+        with _switch:
+            if verified:
+                _unchecked_loads -= 1
+                if not _unchecked_loads:
+                    os.environ.pop(CHECKSUM_ENV_VAR, None)
+            else:
+                _checked_load = False
+            _switch.notify_all()
@@ -0,0 +1,94 @@
+"""
+postprocess.py - Output post-processing for BGTANK
+
+Trims the transparent border around the subject, adds padding and fits the
+result to the maximum output size in one pass over the RGBA result, right
+before it is encoded. Each output is encoded once, with no second pass over
+the written files.
+
+It also tells which images have no background to remove: inputs that are
+already cut out or that BGTANK wrote itself, and results whose mask covers the
+whole frame. Those keep their original instead of a re-encoded copy.
+"""
+
+import numpy as np
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+ALPHA_THRESHOLD = 8  # Alpha at or below this counts as background, ignores faint matting haze
+OUTPUT_MARKER = "BGTANK"  # PNG text key written into every output
+CUT_OUT_MIN_TRANSPARENT = 0.02  # Share of fully transparent pixels that marks an input as already cut out
+FULL_COVERAGE = 0.995  # Share of opaque mask pixels above which nothing was removed
+
+
+def subject_bbox(image, threshold=ALPHA_THRESHOLD):
+    """Bounding box (left, top, right, bottom) of the opaque pixels, None when nothing is opaque"""
+    alpha = np.asarray(image.getchannel("A"))
+    mask = alpha > threshold
+    rows = np.flatnonzero(mask.any(axis=1))
+    if not rows.size:
+        return None
+    columns = np.flatnonzero(mask.any(axis=0))
+    return int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1
+
+
+def finish_output(image, crop=False, padding=0, max_size=0):
+    """Crop to the subject, fit into max_size and pad the RGBA result, returns the image to encode
+
+    max_size includes the padding, which is reduced when it would leave no
+    room for the image. An image without any opaque pixel is kept whole
+    rather than cropped away.
+    """
+    if crop:
+        bbox = subject_bbox(image)
+        if bbox and bbox != (0, 0) + image.size:
+            image = image.crop(bbox)
+
+    # Scale so the padded image fits, the padding itself stays at its pixel size
+    if max_size:
+        padding = min(padding, (max_size - 1) // 2)
+        room = max_size - 2 * padding
+        if max(image.size) > room:
+            scale = room / max(image.size)
+            image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                                 Image.LANCZOS)
+
+    if padding:
+        canvas = Image.new("RGBA", (image.width + 2 * padding, image.height + 2 * padding), (0, 0, 0, 0))
+        canvas.paste(image, (padding, padding))
+        image = canvas
+    return image
+
+
+def output_info():
+    """PNG text chunk that marks a file as a BGTANK output"""
+    info = PngInfo()
+    info.add_text(OUTPUT_MARKER, "background removed")
+    return info
+
+
+def has_alpha(image):
+    return image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+
+
+def transparent_fraction(image):
+    """Share of the pixels that are fully transparent"""
+    if image.mode not in ("RGBA", "LA", "PA"):
+        image = image.convert("RGBA")
+    alpha = np.asarray(image.getchannel("A"))
+    return np.count_nonzero(alpha == 0) / alpha.size
+
+
+def passthrough_reason(image):
+    """Why a decoded input needs no background removal, None when it does"""
+    if OUTPUT_MARKER in image.info:
+        return "BGTANK output"
+    if has_alpha(image) and transparent_fraction(image) >= CUT_OUT_MIN_TRANSPARENT:
+        return "already transparent"
+    return None
+
+
+def mask_coverage(image, threshold=ALPHA_THRESHOLD):
+    """Share of the pixels the mask keeps"""
+    alpha = np.asarray(image.getchannel("A"))
+    return np.count_nonzero(alpha > threshold) / alpha.size
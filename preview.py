@@ -0,0 +1,100 @@
+"""
+preview.py - Before/after previews for BGTANK
+
+Runs a small, evenly spread sample of the selected images through the loaded
+model so the model choice can be checked before a long run. The samples are
+decoded at a fraction of their size, processed one at a time on a single
+low-priority thread with sessions from the warm pool, and every result is
+posted as soon as it is ready, the same way the engine reports progress.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+
+from PIL import Image
+
+from engine import decode_image, open_source, run_model
+from models import AUTO_MODEL, choose_model
+
+PREVIEW_SAMPLES = 6  # Images previewed from a selection
+PREVIEW_INPUT_SIZE = 512  # Longest side the samples are decoded at
+THUMBNAIL_SIZE = 160
+CHECKER_SIZE = 8  # Square size of the transparency checkerboard
+PREVIEW_NICENESS = 10  # Added to the preview thread's nice value where the OS allows it
+
+PreviewResult = namedtuple("PreviewResult", ["path", "before", "after", "model", "seconds", "error"])
+
+
+def sample_paths(paths, count=PREVIEW_SAMPLES):
+    """Evenly spaced sample of the selection, so the preview covers all of it and not just the start"""
+    paths = list(paths)
+    if len(paths) <= count:
+        return paths
+    step = len(paths) / count
+    return [paths[int(i * step)] for i in range(count)]
+
+
+def lower_thread_priority():
+    """Let the calling thread yield the CPU to the GUI and running batches
+
+    Only Linux sets priorities per thread, elsewhere this would slow down the
+    whole app, so the thread keeps its normal priority there.
+    """
+    if not sys.platform.startswith("linux"):
+        return
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), PREVIEW_NICENESS)
+    except (AttributeError, OSError):
+        pass
+
+
+def checkerboard(size):
+    """Gray checkerboard that shows where the result is transparent"""
+    board = Image.new("RGBA", size, (255, 255, 255, 255))
+    dark = Image.new("RGBA", (CHECKER_SIZE, CHECKER_SIZE), (204, 204, 204, 255))
+    for y in range(0, size[1], CHECKER_SIZE):
+        for x in range((y // CHECKER_SIZE) % 2 * CHECKER_SIZE, size[0], CHECKER_SIZE * 2):
+            board.paste(dark, (x, y))
+    return board
+
+
+def make_thumbnails(image, result):
+    """Thumbnail of the input and of the result over a checkerboard"""
+    before = image.convert("RGB")
+    before.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.LANCZOS)
+    after = result.convert("RGBA")
+    after.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.LANCZOS)
+    return before, Image.alpha_composite(checkerboard(after.size), after).convert("RGB")
+
+
+def render_preview(session_pool, model_name, path):
+    """Process one downscaled sample, returns a PreviewResult"""
+    image_model = model_name
+    try:
+        start = time.perf_counter()
+        with open_source(path) as source:
+            image, _ = decode_image(source, PREVIEW_INPUT_SIZE)
+        if model_name == AUTO_MODEL:
+            image_model = choose_model(image)
+        result = run_model(session_pool, image, image_model)
+        seconds = time.perf_counter() - start
+        before, after = make_thumbnails(image, result)
+        return PreviewResult(path, before, after, image_model, seconds, None)
+    except Exception as e:
+        return PreviewResult(path, None, None, image_model, None, str(e))
+
+
+def render_previews(session_pool, model_name, paths, message_queue, cancel, token=None):
+    """Post a ("preview", (token, PreviewResult)) message per sample until done or cancelled
+
+    Meant to run in its own thread. token lets the receiver drop results of a
+    preview it has already closed.
+    """
+    lower_thread_priority()
+    for path in paths:
+        if cancel.is_set():
+            return
+        message_queue.put(("preview", (token, render_preview(session_pool, model_name, path))))
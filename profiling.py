@@ -0,0 +1,133 @@
+"""
+profiling.py - Optional per-run profiling for BGTANK
+
+Runs a sampled subset of images under cProfile and through a separate session
+with onnxruntime's kernel profiling turned on. When the run ends, the merged
+cProfile stats, the onnxruntime traces and a short text summary of the top
+hotspots are written next to the run report. That shows whether the time goes
+to Python code in rembg, onnxruntime kernels, alpha matting or PNG encoding.
+"""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from models import create_session
+
+DEFAULT_PROFILE_EVERY = 10  # Profile one image in this many
+MAX_PROFILED_IMAGES = 100  # Enough samples for stable numbers without slowing long runs down
+TOP_FUNCTIONS = 25
+TOP_KERNELS = 15
+
+
+class RunProfiler:
+    """Profiles every Nth image of a run, one image at a time"""
+
+    def __init__(self, report_path, every=DEFAULT_PROFILE_EVERY):
+        self.base_path = os.path.splitext(report_path)[0]
+        self.every = max(1, every)
+        self.seen = 0
+        self.profiled = 0
+        self.stats = None
+        self.sessions = {}
+        self.trace_paths = []
+        self.lock = threading.Lock()
+        # cProfile can't run twice at once, so samples are taken one after another
+        self.sample_lock = threading.Lock()
+
+    def profiled_session(self, model_name):
+        """Session with onnxruntime profiling on, used only for sampled images"""
+        if model_name not in self.sessions:
+            self.sessions[model_name] = create_session(model_name,
+                                                       profile_prefix=f"{self.base_path}_onnxruntime_{model_name}")
+        return self.sessions[model_name]
+
+    @contextmanager
+    def sample(self, model_name):
+        """Profile the block if this image is sampled, yields the profiled session or None"""
+        with self.lock:
+            self.seen += 1
+            take = self.seen % self.every == 0 and self.profiled < MAX_PROFILED_IMAGES
+
+        # Skip instead of waiting when another sample is still running
+        if not take or not self.sample_lock.acquire(blocking=False):
+            yield None
+            return
+
+        try:
+            # Load the session before the profiler starts so loading isn't counted
+            session = self.profiled_session(model_name)
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler is active in this process
+                yield None
+                return
+
+            try:
+                yield session
+            finally:
+                profile.disable()
+                with self.lock:
+                    self.profiled += 1
+                    if self.stats is None:
+                        self.stats = pstats.Stats(profile)
+                    else:
+                        self.stats.add(profile)
+        finally:
+            self.sample_lock.release()
+
+    def close(self):
+        """Write the profile files and the hotspot summary, returns the summary path or None"""
+        for session in self.sessions.values():
+            try:
+                self.trace_paths.append(session.inner_session.end_profiling())
+            except Exception:
+                pass
+
+        if self.stats is None:
+            return None
+
+        self.stats.dump_stats(f"{self.base_path}.prof")
+        summary_path = f"{self.base_path}_profile.txt"
+        with open(summary_path, "w", encoding="utf-8") as f:
+            f.write(f"Profiled {self.profiled} of {self.seen} images\n\n")
+            f.write(self.function_summary("cumulative"))
+            f.write(self.function_summary("tottime"))
+            for trace_path in self.trace_paths:
+                f.write(kernel_summary(trace_path))
+        return summary_path
+
+    def function_summary(self, sort_key):
+        """Top functions of the merged cProfile stats as text"""
+        text = io.StringIO()
+        self.stats.stream = text
+        text.write(f"=== Python functions by {sort_key} time ===\n")
+        self.stats.sort_stats(sort_key).print_stats(TOP_FUNCTIONS)
+        return text.getvalue()
+
+
+def kernel_summary(trace_path):
+    """Total time per onnxruntime operator type in a profiling trace"""
+    try:
+        with open(trace_path, encoding="utf-8") as f:
+            events = json.load(f)
+    except (OSError, ValueError):
+        return ""
+
+    totals = defaultdict(int)
+    for event in events:
+        if event.get("cat") == "Node" and event.get("name", "").endswith("_kernel_time"):
+            totals[event.get("args", {}).get("op_name", "?")] += event.get("dur", 0)
+
+    total = sum(totals.values()) or 1
+    lines = [f"=== onnxruntime kernels: {os.path.basename(trace_path)} ==="]
+    for op_name, duration in sorted(totals.items(), key=lambda item: item[1], reverse=True)[:TOP_KERNELS]:
+        lines.append(f"{op_name:<24} {duration / 1e6:10.3f}s {duration / total:7.1%}")
+    return "\n".join(lines) + "\n\n"
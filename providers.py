@@ -0,0 +1,168 @@
+"""
+providers.py - Execution provider selection for BGTANK
+
+onnxruntime builds such as onnxruntime-openvino or builds with oneDNN offer
+execution providers that run faster than the plain CPU provider on Intel CPUs.
+When one is installed, each model is benchmarked once with every candidate
+against the CPU provider on a synthetic warm-up image, and the fastest is used
+from then on. The results are kept in a per-machine profile, which is measured
+again when the hardware, the onnxruntime version or the installed providers
+change. Without optional providers nothing is measured and the CPU provider is
+used, as before.
+"""
+
+import json
+import os
+import platform
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+from PIL import Image
+
+CPU_PROVIDER = "CPUExecutionProvider"
+# Optional providers worth measuring, in order of preference when they tie
+CANDIDATE_PROVIDERS = ["OpenVINOExecutionProvider", "DnnlExecutionProvider"]
+PROVIDER_ENV_VAR = "BGTANK_EXECUTION_PROVIDER"  # Forces a provider and skips the benchmark
+
+PROFILE_DIR = os.path.join(os.path.expanduser("~"), ".bgtank")
+PROFILE_PATH = os.path.join(PROFILE_DIR, "machine_profile.json")
+BENCHMARK_RUNS = 3  # Timed runs after the warm-up run, the median counts
+MIN_SPEEDUP = 1.05  # A provider must beat the best so far, starting with the CPU, by this factor
+
+_choice_lock = threading.Lock()
+_choices = {}
+
+
+def available_candidates():
+    """Optional providers the installed onnxruntime offers"""
+    import onnxruntime as ort
+    available = ort.get_available_providers()
+    return [provider for provider in CANDIDATE_PROVIDERS if provider in available]
+
+
+def provider_list(provider):
+    """Providers to hand to a session, the CPU provider takes whatever the first can't run"""
+    return [provider] if provider == CPU_PROVIDER else [provider, CPU_PROVIDER]
+
+
+def machine_key():
+    """Everything a measurement depends on besides the model"""
+    import onnxruntime as ort
+    return " ".join([platform.machine(), platform.processor() or "?", f"cpus={os.cpu_count()}",
+                     f"onnxruntime={ort.__version__}", f"providers={','.join(available_candidates())}"])
+
+
+def load_profile():
+    """Machine profile, empty when missing or measured on a different setup"""
+    try:
+        with open(PROFILE_PATH, encoding="utf-8") as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        return {"machine": machine_key(), "models": {}}
+    if profile.get("machine") != machine_key():
+        return {"machine": machine_key(), "models": {}}
+    return profile
+
+
+def save_profile(profile):
+    """Write the profile atomically, the choice is simply measured again if this fails"""
+    tmp_path = f"{PROFILE_PATH}.tmp"
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(profile, f, indent=2)
+        os.replace(tmp_path, PROFILE_PATH)
+    except OSError:
+        pass
+
+
+def warmup_image(size):
+    """Synthetic photo-like image: a shaded subject on a gradient backdrop"""
+    y, x = np.mgrid[0:size, 0:size].astype(np.float32) / size
+    pixels = np.stack([200 - 80 * y, 190 - 60 * y, 180 - 40 * x], axis=2)
+    subject = (x - 0.5) ** 2 + (y - 0.55) ** 2 < 0.08
+    pixels[subject] = np.stack([120 * x, 60 + 80 * y, 90 * (1 - x)], axis=2)[subject]
+    noise = np.random.default_rng(0).normal(0, 6, pixels.shape)
+    return Image.fromarray(np.clip(pixels + noise, 0, 255).astype(np.uint8))
+
+
+def time_provider(model_name, provider):
+    """Median seconds per inference with a provider, None if the provider doesn't load the model"""
+    from models import create_session, get_profile
+
+    session = create_session(model_name, providers=provider_list(provider))
+    # onnxruntime quietly drops a provider it can't initialize
+    if provider not in session.inner_session.get_providers():
+        return None
+
+    image = warmup_image(get_profile(model_name).input_size)
+    # The first run allocates buffers and, for OpenVINO, compiles the graph
+    session.predict(image)
+    times = []
+    for _ in range(BENCHMARK_RUNS):
+        start = time.perf_counter()
+        session.predict(image)
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def benchmark(model_name):
+    """Time the CPU provider and every optional one, returns {provider: seconds}"""
+    results = {}
+    for provider in [CPU_PROVIDER] + available_candidates():
+        try:
+            seconds = time_provider(model_name, provider)
+        except Exception:
+            # A provider that fails on this model is simply not used
+            continue
+        if seconds is not None:
+            results[provider] = round(seconds, 4)
+    return results
+
+
+def fastest_provider(results):
+    """Pick the quickest provider, the CPU provider unless another is clearly faster"""
+    best = CPU_PROVIDER
+    best_seconds = results.get(CPU_PROVIDER, float("inf"))
+    for provider in CANDIDATE_PROVIDERS:
+        seconds = results.get(provider)
+        if seconds is not None and seconds * MIN_SPEEDUP < best_seconds:
+            best, best_seconds = provider, seconds
+    return best
+
+
+def choose_providers(model_name):
+    """Providers for a model's sessions, benchmarked once per machine and cached"""
+    forced = os.environ.get(PROVIDER_ENV_VAR)
+    if forced:
+        return provider_list(forced)
+
+    with _choice_lock:
+        if model_name in _choices:
+            return _choices[model_name]
+
+        try:
+            candidates = available_candidates()
+        except ImportError:
+            candidates = []
+
+        provider = CPU_PROVIDER
+        if candidates:
+            profile = load_profile()
+            entry = profile["models"].get(model_name)
+            if entry and entry.get("provider") in [CPU_PROVIDER] + candidates:
+                provider = entry["provider"]
+            else:
+                results = benchmark(model_name)
+                provider = fastest_provider(results)
+                profile["models"][model_name] = {
+                    "provider": provider,
+                    "seconds": results,
+                    "measured": datetime.now().isoformat(timespec="seconds"),
+                }
+                save_profile(profile)
+
+        _choices[model_name] = provider_list(provider)
+        return _choices[model_name]
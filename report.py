@@ -0,0 +1,82 @@
+"""
+report.py - Machine-readable run reports for BGTANK
+
+Every processed image is appended to a JSON Lines file as soon as it finishes,
+so the report can be tailed while a large run is still going.
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+REPORT_PREFIX = "bgtank_report_"
+REPORT_BUFFER_SIZE = 64 * 1024  # Bytes buffered before the file is written
+REPORT_FLUSH_INTERVAL = 2.0  # Seconds between flushes so tail -f stays current
+
+
+def report_path_for(output_dir, started=None):
+    """Build the report path for a run that writes into output_dir"""
+    started = started or datetime.now()
+    return os.path.join(output_dir, f"{REPORT_PREFIX}{started.strftime('%Y%m%d_%H%M%S')}.jsonl")
+
+
+class RunReport:
+    """Appends one JSON record per image to a buffered JSON Lines file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "a", encoding="utf-8", buffering=REPORT_BUFFER_SIZE)
+        self.last_flush = time.monotonic()
+        self.counts = {}
+
+    def write(self, record):
+        """Append a record, flushing at most every REPORT_FLUSH_INTERVAL seconds"""
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(line)
+            status = record.get("status")
+            if status:
+                self.counts[status] = self.counts.get(status, 0) + 1
+
+            now = time.monotonic()
+            if now - self.last_flush >= REPORT_FLUSH_INTERVAL:
+                self.file.flush()
+                self.last_flush = now
+
+    def write_image(self, input_path, output_path, status, model, timings=None,
+                    width=None, height=None, error=None, **extra):
+        """Append the result record for a single image"""
+        record = {
+            "type": "image",
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "input": input_path,
+            "output": output_path,
+            "status": status,
+            "error": error,
+            "model": model,
+            "width": width,
+            "height": height,
+            "timings": {name: round(value, 4) for name, value in (timings or {}).items()},
+        }
+        record.update(extra)
+        self.write(record)
+
+    def close(self, **summary):
+        """Write the run summary record and close the file"""
+        with self.lock:
+            if self.file is None:
+                return
+            record = {
+                "type": "summary",
+                "time": datetime.now().isoformat(timespec="seconds"),
+                "counts": dict(self.counts),
+            }
+            record.update(summary)
+            self.file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+            self.file.close()
+            self.file = None
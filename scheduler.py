@@ -0,0 +1,131 @@
+"""
+scheduler.py - Job ordering and memory-aware work admission for BGTANK
+
+Reads image dimensions from the file headers, without decoding, to order the
+job (largest images first so no single huge image is left for the end) and to
+estimate how much RAM an image will need. Images only enter the pipeline while
+they fit into a global memory budget, so large images run with fewer
+neighbours.
+"""
+
+import threading
+from collections import defaultdict
+
+from PIL import Image
+
+from archives import open_input
+from models import MEMORY_FRACTION, get_profile, models_for, total_memory_mb
+
+# Working memory per pixel while an image is in flight: decoded RGB, the RGBA
+# result, the mask and rembg's float intermediates. Alpha matting builds a
+# sparse matting Laplacian, which costs far more per pixel.
+BYTES_PER_PIXEL = 48
+MATTING_BYTES_PER_PIXEL = 240
+FALLBACK_PIXELS = 12 * 1000 * 1000  # Assumed size when the header can't be read
+MIN_BUDGET_MB = 512
+
+ORDER_LARGEST_FIRST = "largest first"
+ORDER_BY_RESOLUTION = "by resolution"
+ORDER_AS_SELECTED = "as selected"
+JOB_ORDERS = [ORDER_LARGEST_FIRST, ORDER_BY_RESOLUTION, ORDER_AS_SELECTED]
+RESOLUTION_BUCKET = 64  # Pixels, images whose sides round to the same multiple share a bucket
+
+
+def read_image_size(path):
+    """Read the image dimensions from the file header without decoding"""
+    try:
+        with open_input(path) as f, Image.open(f) as image:
+            return image.size
+    except Exception:
+        return None
+
+
+def probe_image_sizes(paths, executor):
+    """Read the header dimensions of many images in parallel, unreadable images map to None"""
+    return dict(zip(paths, executor.map(read_image_size, paths)))
+
+
+def working_size(size, max_size=0):
+    """Dimensions an image is processed at once the output size cap is applied"""
+    width, height = size
+    if max_size and max(width, height) > max_size:
+        scale = max_size / max(width, height)
+        return max(1, round(width * scale)), max(1, round(height * scale))
+    return width, height
+
+
+def working_pixels(size, max_size=0):
+    """Pixel count an image is processed at, used to weight progress"""
+    if not size:
+        return FALLBACK_PIXELS
+    width, height = working_size(size, max_size)
+    return width * height
+
+
+def order_jobs(paths, sizes, order=ORDER_LARGEST_FIRST, max_size=0):
+    """Order the job so the longest images start first or same-sized images run together"""
+    if order == ORDER_LARGEST_FIRST:
+        return sorted(paths, key=lambda path: working_pixels(sizes.get(path), max_size), reverse=True)
+
+    if order == ORDER_BY_RESOLUTION:
+        buckets = defaultdict(list)
+        for path in paths:
+            size = sizes.get(path)
+            if size:
+                width, height = working_size(size, max_size)
+                key = (round(width / RESOLUTION_BUCKET), round(height / RESOLUTION_BUCKET))
+            else:
+                key = (0, 0)
+            buckets[key].append(path)
+
+        # Largest buckets first, selection order inside each bucket
+        ordered = []
+        for key in sorted(buckets, key=lambda k: k[0] * k[1], reverse=True):
+            ordered.extend(buckets[key])
+        return ordered
+
+    return list(paths)
+
+
+def estimate_image_mb(size, model_name, max_size=0):
+    """Estimate the peak memory of one image in flight, including the model's activations"""
+    profiles = [get_profile(name) for name in models_for(model_name)]
+    pixels = working_pixels(size, max_size)
+
+    per_pixel = MATTING_BYTES_PER_PIXEL if any(p.alpha_matting for p in profiles) else BYTES_PER_PIXEL
+    # Every concurrent inference needs roughly one more footprint of activations
+    activations_mb = max(p.memory_mb for p in profiles)
+    return pixels * per_pixel / (1024 * 1024) + activations_mb
+
+
+def default_memory_budget(model_name, loaded_mb=None):
+    """Memory the images in flight may use: a share of physical RAM minus the loaded sessions"""
+    if loaded_mb is None:
+        loaded_mb = sum(get_profile(name).memory_mb for name in models_for(model_name))
+    return max(MIN_BUDGET_MB, int(total_memory_mb() * MEMORY_FRACTION - loaded_mb))
+
+
+class MemoryBudget:
+    """Blocks admission of new work until its estimated memory fits the budget"""
+
+    def __init__(self, budget_mb):
+        self.budget_mb = budget_mb
+        self.in_use_mb = 0
+        # Admissions are counted so float rounding in in_use_mb can never keep a lone image waiting
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, cost_mb):
+        """Wait until cost_mb fits, an image bigger than the whole budget runs alone"""
+        with self.condition:
+            while self.in_flight and self.in_use_mb + cost_mb > self.budget_mb:
+                self.condition.wait()
+            self.in_flight += 1
+            self.in_use_mb += cost_mb
+
+    def release(self, cost_mb):
+        """Return memory to the budget and wake the dispatcher"""
+        with self.condition:
+            self.in_flight -= 1
+            self.in_use_mb = max(0, self.in_use_mb - cost_mb) if self.in_flight else 0
+            self.condition.notify_all()
@@ -0,0 +1,149 @@
+"""
+sessionpool.py - Thread-safe pool of rembg sessions for BGTANK
+
+Worker threads check a session out around every inference and return it
+afterwards, so two threads never share a session unless the pool runs in shared
+mode. When RAM allows, every worker gets its own session with a share of the
+CPU cores. When the weights of several copies would not fit, one session is
+shared by all workers, which is safe because onnxruntime sessions accept
+concurrent runs. The first session is built with every core before the pool
+size is known and is rebuilt with its share once the pool is resized, so the
+copies never oversubscribe the CPU. The pool belongs to the run that uses
+it, so switching the model in the GUI builds a new pool instead of changing
+sessions under a running job.
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+
+from models import create_session, get_profile, models_for, total_memory_mb
+
+SESSION_MEMORY_FRACTION = 0.25  # Share of RAM the session copies of one model may take
+
+
+def pool_size(model_name, workers, memory_mb=None):
+    """Sessions per model: one per worker while their weights fit in RAM, otherwise one shared"""
+    memory_mb = memory_mb or total_memory_mb()
+    size = workers
+    for name in models_for(model_name):
+        size = min(size, int(memory_mb * SESSION_MEMORY_FRACTION // get_profile(name).memory_mb))
+    return max(1, size)
+
+
+class SessionPool:
+    """Hands out the sessions of a model setting to worker threads"""
+
+    def __init__(self, model_name, warm_pool=None, progress=None):
+        self.model_name = model_name
+        self.size = 1
+        self.condition = threading.Condition()
+
+        # Load one session per model now, further copies are created on demand by the workers.
+        # Sessions of a previous pool are reused when it had the same model loaded
+        self.first = {}
+        self.first_threads = {}  # Intra-op threads each first session was built with
+        for name in models_for(model_name):
+            session = warm_pool.first.get(name) if warm_pool else None
+            if session is not None:
+                self.first_threads[name] = warm_pool.first_threads[name]
+            else:
+                session = create_session(name, progress=progress)
+                self.first_threads[name] = 0
+            self.first[name] = session
+        self.idle = {name: [session] for name, session in self.first.items()}
+        self.created = dict.fromkeys(self.first, 1)
+        self.replacing = set()  # Models whose first session is being rebuilt
+        self.retired = []  # (old, new) first sessions replaced while checked out, swapped when they come back
+
+    def resize(self, size):
+        """Set how many sessions per model may exist, 1 shares a single session between all threads"""
+        with self.condition:
+            self.size = max(1, size)
+            self.condition.notify_all()
+
+    def session_threads(self):
+        """Intra-op threads per session: every core for a shared session, an equal share per copy"""
+        return 0 if self.size == 1 else max(1, (os.cpu_count() or 1) // self.size)
+
+    def replace_first(self, model_name):
+        """Rebuild the first session of a model with the thread count of the current size
+
+        Other threads keep using the old session meanwhile. If the rebuild
+        fails the old one simply stays.
+        """
+        threads = self.session_threads()
+        try:
+            session = create_session(model_name, threads)
+        except Exception:
+            session = None
+        with self.condition:
+            self.replacing.discard(model_name)
+            if session is None:
+                return
+            old = self.first[model_name]
+            self.first[model_name] = session
+            self.first_threads[model_name] = threads
+            # The new session takes the old one's slot, once the old one is back if it is in use
+            if any(idle is old for idle in self.idle[model_name]):
+                self.idle[model_name] = [idle for idle in self.idle[model_name] if idle is not old]
+                self.idle[model_name].append(session)
+            else:
+                self.retired.append((old, session))
+            self.condition.notify_all()
+
+    def memory_mb(self):
+        """Approximate memory of the sessions once the pool is full"""
+        return self.size * sum(get_profile(name).memory_mb for name in self.first)
+
+    @contextmanager
+    def checkout(self, model_name):
+        """Borrow a session for one inference, blocks while every session is in use"""
+        with self.condition:
+            # After a resize, the first thread to come along rebuilds the first session
+            rebuild = (self.first_threads[model_name] != self.session_threads() and
+                       model_name not in self.replacing)
+            if rebuild:
+                self.replacing.add(model_name)
+            if self.size == 1:
+                shared = True
+                session = self.first[model_name]
+            else:
+                shared = False
+                while not self.idle[model_name] and self.created[model_name] >= self.size:
+                    self.condition.wait()
+                if self.idle[model_name]:
+                    session = self.idle[model_name].pop()
+                else:
+                    # Reserve the slot, the session itself is loaded outside the lock
+                    session = None
+                    self.created[model_name] += 1
+
+        if rebuild:
+            self.replace_first(model_name)
+
+        if session is None:
+            try:
+                session = create_session(model_name, max(1, (os.cpu_count() or 1) // self.size))
+            except Exception:
+                with self.condition:
+                    self.created[model_name] -= 1
+                    self.condition.notify_all()
+                raise
+
+        try:
+            yield session
+        finally:
+            if not shared:
+                with self.condition:
+                    replacement = next((new for old, new in self.retired if old is session), None)
+                    if replacement is not None:
+                        # Replaced by a rebuilt first session, which takes over its slot
+                        self.retired = [(old, new) for old, new in self.retired if old is not session]
+                        self.idle[model_name].append(replacement)
+                    elif self.created[model_name] > self.size and session is not self.first[model_name]:
+                        # The pool was shrunk, let this copy go
+                        self.created[model_name] -= 1
+                    else:
+                        self.idle[model_name].append(session)
+                    self.condition.notify_all()
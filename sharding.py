@@ -0,0 +1,300 @@
+"""
+sharding.py - Multi-node batch processing through a shared job directory
+
+A job directory on a shared filesystem holds the manifest and the inputs split
+into chunk files. Every render node claims chunks by atomically creating a
+lease file, keeps the lease alive with a heartbeat while it works, and marks
+the chunk done when it finishes. Leases of dead nodes stop being refreshed,
+expire and are reclaimed by the other nodes. No queue service is needed, only
+a filesystem where O_EXCL creates and renames are atomic (local disks, SMB and
+NFSv3 or later). Images that fail are listed per chunk and can be queued
+again as new chunks.
+
+Layout:
+    manifest.json            job settings
+    chunks/chunk_000000.txt  input paths, one per line
+    leases/chunk_000000.lease
+    done/chunk_000000.done
+    failed/chunk_000000.txt  input paths that failed, one per line
+    reports/chunk_000000.jsonl
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+
+MANIFEST_NAME = "manifest.json"
+DEFAULT_CHUNK_SIZE = 100
+DEFAULT_LEASE_TTL = 300  # Seconds without a heartbeat before a lease is considered dead
+
+
+def default_node_id():
+    """Name this node by host and process"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def chunk_name(index):
+    """File name stem of a chunk"""
+    return f"chunk_{index:06d}"
+
+
+def create_job(job_dir, input_paths, output_dir, settings=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Write the manifest and chunk files for a sharded job, returns the manifest"""
+    for sub_dir in ("chunks", "leases", "done", "failed", "reports"):
+        os.makedirs(os.path.join(job_dir, sub_dir), exist_ok=True)
+
+    chunk_count = write_chunks(job_dir, input_paths, chunk_size)
+    manifest = {
+        "version": 1,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "output_dir": output_dir,
+        "inputs": len(input_paths),
+        "chunk_size": chunk_size,
+        "chunks": chunk_count,
+        "settings": settings or {},
+    }
+
+    # Write the manifest last so nodes never see a half-created job
+    save_manifest(job_dir, manifest)
+    return manifest
+
+
+def write_chunks(job_dir, input_paths, chunk_size, first_index=0):
+    """Split paths into chunk files numbered from first_index, returns the index after the last"""
+    index = first_index
+    for start in range(0, len(input_paths), chunk_size):
+        chunk_path = os.path.join(job_dir, "chunks", f"{chunk_name(index)}.txt")
+        with open(chunk_path, "w", encoding="utf-8") as f:
+            f.writelines(f"{path}\n" for path in input_paths[start:start + chunk_size])
+        index += 1
+    return index
+
+
+def save_manifest(job_dir, manifest):
+    tmp_path = os.path.join(job_dir, f"{MANIFEST_NAME}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(job_dir, MANIFEST_NAME))
+
+
+def load_manifest(job_dir):
+    """Read the manifest of a sharded job"""
+    with open(os.path.join(job_dir, MANIFEST_NAME), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def read_chunk(job_dir, index):
+    """Read the input paths of a chunk"""
+    with open(os.path.join(job_dir, "chunks", f"{chunk_name(index)}.txt"), encoding="utf-8") as f:
+        return [line.rstrip("\n") for line in f if line.strip()]
+
+
+def write_failures(job_dir, index, paths):
+    """List the inputs of a chunk that failed, an empty list clears an earlier one"""
+    failed_dir = os.path.join(job_dir, "failed")
+    failed_path = os.path.join(failed_dir, f"{chunk_name(index)}.txt")
+    if not paths:
+        try:
+            os.remove(failed_path)
+        except OSError:
+            pass
+        return
+    os.makedirs(failed_dir, exist_ok=True)
+    tmp_path = f"{failed_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.writelines(f"{path}\n" for path in paths)
+    os.replace(tmp_path, failed_path)
+
+
+def read_failures(job_dir):
+    """Failed input paths of every chunk, as {failure list path: paths}"""
+    failed_dir = os.path.join(job_dir, "failed")
+    try:
+        names = sorted(name for name in os.listdir(failed_dir) if name.endswith(".txt"))
+    except OSError:
+        return {}
+    failures = {}
+    for name in names:
+        path = os.path.join(failed_dir, name)
+        with open(path, encoding="utf-8") as f:
+            failures[path] = [line.rstrip("\n") for line in f if line.strip()]
+    return failures
+
+
+def requeue_failures(job_dir):
+    """Queue every failed input again as new chunks, returns how many
+
+    Nodes that are still running pick the new chunks up once they run out of
+    work, the others when they are started again.
+    """
+    manifest = load_manifest(job_dir)
+    failures = read_failures(job_dir)
+    paths = [path for chunk_paths in failures.values() for path in chunk_paths]
+    if not paths:
+        return 0
+    manifest["chunks"] = write_chunks(job_dir, paths, manifest["chunk_size"], manifest["chunks"])
+    save_manifest(job_dir, manifest)
+    for failed_path in failures:
+        os.remove(failed_path)
+    return len(paths)
+
+
+def job_status(job_dir, lease_ttl=DEFAULT_LEASE_TTL):
+    """Count done, running, expired and waiting chunks and the failed images"""
+    manifest = load_manifest(job_dir)
+    now = time.time()
+    done = running = expired = 0
+    for index in range(manifest["chunks"]):
+        name = chunk_name(index)
+        if os.path.exists(os.path.join(job_dir, "done", f"{name}.done")):
+            done += 1
+            continue
+        try:
+            age = now - os.path.getmtime(os.path.join(job_dir, "leases", f"{name}.lease"))
+        except OSError:
+            continue
+        if age > lease_ttl:
+            expired += 1
+        else:
+            running += 1
+
+    return {
+        "chunks": manifest["chunks"],
+        "done": done,
+        "running": running,
+        "expired": expired,
+        "waiting": manifest["chunks"] - done - running - expired,
+        "failed": sum(len(paths) for paths in read_failures(job_dir).values()),
+    }
+
+
+class ShardLease:
+    """A claimed chunk, kept alive by a heartbeat thread until it is completed or released"""
+
+    def __init__(self, job_dir, index, node_id, lease_ttl, lease_id):
+        self.job_dir = job_dir
+        self.index = index
+        self.node_id = node_id
+        self.lease_id = lease_id  # Written into the lease file, tells this lease from a newer one
+        self.lease_ttl = lease_ttl
+        self.path = os.path.join(job_dir, "leases", f"{chunk_name(index)}.lease")
+        self.stop_event = threading.Event()
+        self.heartbeat = threading.Thread(target=self._heartbeat, daemon=True)
+
+    def start(self):
+        self.heartbeat.start()
+
+    def _heartbeat(self):
+        """Touch the lease file so other nodes know this node is alive"""
+        while not self.stop_event.wait(self.lease_ttl / 3):
+            # Never refresh a lease another node took over after a long stall,
+            # the chunk may be processed twice then but the other node's lease stays honest
+            owner = lease_id_of(self.path)
+            if owner is None:
+                # Moved aside for a moment by a node checking whether it expired
+                continue
+            if owner != self.lease_id:
+                return
+            try:
+                os.utime(self.path)
+            except OSError:
+                pass
+
+    def owns_lease(self):
+        return lease_id_of(self.path) == self.lease_id
+
+    def complete(self):
+        """Mark the chunk done and drop the lease"""
+        self.stop_event.set()
+        done_path = os.path.join(self.job_dir, "done", f"{chunk_name(self.index)}.done")
+        with open(done_path, "w", encoding="utf-8") as f:
+            json.dump({"node": self.node_id, "finished": datetime.now().isoformat(timespec="seconds")}, f)
+        self.release()
+
+    def release(self):
+        """Give the chunk back without marking it done"""
+        self.stop_event.set()
+        if not self.owns_lease():
+            return
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def lease_id_of(path):
+    """Id written into a lease file, None if it is missing or unreadable"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f).get("lease")
+    except (OSError, ValueError):
+        return None
+
+
+def lease_expired(path, lease_ttl):
+    return time.time() - os.path.getmtime(path) > lease_ttl
+
+
+def try_claim(job_dir, index, node_id, lease_ttl=DEFAULT_LEASE_TTL):
+    """Atomically claim a chunk, reclaiming an expired lease, returns a ShardLease or None"""
+    name = chunk_name(index)
+    if os.path.exists(os.path.join(job_dir, "done", f"{name}.done")):
+        return None
+
+    lease_path = os.path.join(job_dir, "leases", f"{name}.lease")
+    try:
+        if not lease_expired(lease_path, lease_ttl):
+            return None
+        # Expired: move it aside first, only one node can win the rename
+        stale_path = f"{lease_path}.{uuid.uuid4().hex}.stale"
+        os.rename(lease_path, stale_path)
+        # Another node may have reclaimed the lease between our look and the rename,
+        # then we moved its fresh lease and have to put it back
+        if not lease_expired(stale_path, lease_ttl):
+            restore_lease(stale_path, lease_path)
+            return None
+        os.remove(stale_path)
+    except OSError:
+        # No lease yet, or another node reclaimed it first
+        pass
+
+    lease_id = uuid.uuid4().hex
+    try:
+        fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return None
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump({"node": node_id, "lease": lease_id, "claimed": datetime.now().isoformat(timespec="seconds")}, f)
+
+    lease = ShardLease(job_dir, index, node_id, lease_ttl, lease_id)
+    lease.start()
+    return lease
+
+
+def restore_lease(moved_path, lease_path):
+    """Put a lease moved aside by mistake back, without replacing one created since"""
+    try:
+        os.link(moved_path, lease_path)
+    except FileExistsError:
+        # A third node claimed the chunk in the meantime, its lease wins
+        pass
+    except OSError:
+        # No hard links on this filesystem
+        if not os.path.exists(lease_path):
+            os.rename(moved_path, lease_path)
+            return
+    os.remove(moved_path)
+
+
+def claim_next(job_dir, node_id, chunk_count, lease_ttl=DEFAULT_LEASE_TTL, start=0):
+    """Claim the next free chunk, starting the scan at start so nodes spread out"""
+    for offset in range(chunk_count):
+        index = (start + offset) % chunk_count
+        lease = try_claim(job_dir, index, node_id, lease_ttl)
+        if lease:
+            return lease
+    return None
@@ -0,0 +1,92 @@
+"""
+throughput.py - Live throughput tracking for BGTANK
+
+Keeps exponentially weighted rates in images/sec and megapixels/sec plus a
+per-stage time breakdown. The ETA is based on the megapixels still to go, so
+image sizes and model warm-up don't distort it.
+"""
+
+import threading
+import time
+
+RATE_WINDOW = 1.0  # Seconds of completions folded into each rate sample
+RATE_ALPHA = 0.3  # Weight of the newest rate sample
+STAGE_ALPHA = 0.1  # Weight of the newest stage timing
+
+
+class ThroughputTracker:
+    """Exponentially weighted throughput and ETA, safe to update from worker threads"""
+
+    def __init__(self, total_pixels=0):
+        self.total_pixels = total_pixels
+        self.done_pixels = 0
+        self.done_images = 0
+        self.image_rate = None
+        self.pixel_rate = None
+        self.stage_times = {}
+        self.lock = threading.Lock()
+
+        # The clock starts at the first completion, so model warm-up never counts
+        self.window_start = None
+        self.window_images = 0
+        self.window_pixels = 0
+
+    def set_total(self, total_pixels):
+        """Set the number of pixels the whole job will process"""
+        with self.lock:
+            self.total_pixels = total_pixels
+
+    def record(self, images, pixels, timings=None):
+        """Record finished images, their pixels and their stage timings"""
+        now = time.monotonic()
+        with self.lock:
+            self.done_images += images
+            self.done_pixels += pixels
+
+            for stage, seconds in (timings or {}).items():
+                previous = self.stage_times.get(stage)
+                self.stage_times[stage] = seconds if previous is None else (
+                    STAGE_ALPHA * seconds + (1 - STAGE_ALPHA) * previous)
+
+            if self.window_start is None:
+                self.window_start = now
+                return
+
+            self.window_images += images
+            self.window_pixels += pixels
+            elapsed = now - self.window_start
+            if elapsed < RATE_WINDOW:
+                return
+
+            image_rate = self.window_images / elapsed
+            pixel_rate = self.window_pixels / elapsed
+            if self.image_rate is None:
+                self.image_rate, self.pixel_rate = image_rate, pixel_rate
+            else:
+                self.image_rate = RATE_ALPHA * image_rate + (1 - RATE_ALPHA) * self.image_rate
+                self.pixel_rate = RATE_ALPHA * pixel_rate + (1 - RATE_ALPHA) * self.pixel_rate
+
+            self.window_start = now
+            self.window_images = 0
+            self.window_pixels = 0
+
+    def remaining_seconds(self):
+        """Estimate the time left from the megapixels still to go, None until a rate is known"""
+        with self.lock:
+            if not self.pixel_rate:
+                return None
+            return max(0, self.total_pixels - self.done_pixels) / self.pixel_rate
+
+    def snapshot(self):
+        """Current rates, ETA and per-stage seconds per image as a plain dict"""
+        remaining = self.remaining_seconds()
+        with self.lock:
+            return {
+                "images_done": self.done_images,
+                "megapixels_done": self.done_pixels / 1e6,
+                "megapixels_total": self.total_pixels / 1e6,
+                "images_per_second": self.image_rate,
+                "megapixels_per_second": self.pixel_rate / 1e6 if self.pixel_rate else None,
+                "remaining_seconds": remaining,
+                "stage_seconds": dict(self.stage_times),
+            }